@@ -1,5 +1,7 @@
 import pandas as pd
 
+from TableIO import read_table
+
 # --------------------------------------------------
 # CONFIG
 # --------------------------------------------------
@@ -127,7 +129,8 @@ def generate_prescription(phase_winrates_df):
 
 def main():
     # Load the already-prepared player-only I/M/B file
-    df = pd.read_csv(IMB_PLAYER_CSV)
+    # only the columns used below; read from the .parquet twin when present
+    df = read_table(IMB_PLAYER_CSV, columns=["phase", "error_type", "outcome"])
 
     # Sanity filter: only known error types
     df = df[df["error_type"].isin(ERROR_TYPES)].copy()
@@ -1,5 +1,7 @@
 import pandas as pd
 
+from TableIO import read_table
+
 # --------------------------------------------------
 # CONFIG
 # --------------------------------------------------
@@ -58,23 +60,28 @@ def phase_advice(phase_name: str):
         ]
 
 
+def phase_stats_from_winrates(phase_winrates_df: pd.DataFrame) -> dict:
+    """{phase: {"wins", "total", "win_rate"}}, summed over error types."""
+    # Aggregate over error types to get phase-level win rates
+    phase_summary = phase_winrates_df.groupby("phase")[["win", "total"]].sum()
+
+    phase_stats = {}
+    for phase, wins, total in phase_summary.itertuples():
+        win_rate = wins / total if total > 0 else 0.0
+        phase_stats[phase] = {"wins": wins, "total": total, "win_rate": win_rate}
+    return phase_stats
+
+
 def generate_prescription(phase_winrates_df: pd.DataFrame, label: str) -> str:
     """
     Generalised training prescription based on which phase has the lowest win rate,
     for a given color label (e.g., 'White' or 'Black').
     """
-    # Aggregate over error types to get phase-level win rates
-    phase_summary = (
-        phase_winrates_df
-        .groupby("phase")
-        .apply(lambda g: (g["win"].sum(), g["total"].sum()))
-    )
+    return render_prescription(phase_stats_from_winrates(phase_winrates_df), label)
 
-    phase_stats = {}
-    for phase, (wins, total) in phase_summary.items():
-        win_rate = wins / total if total > 0 else 0.0
-        phase_stats[phase] = {"wins": wins, "total": total, "win_rate": win_rate}
 
+def render_prescription(phase_stats: dict, label: str) -> str:
+    """The prescription text for phase-level stats (see phase_stats_from_winrates)."""
     # Handle case where a color has no data
     if not phase_stats:
         return f"=== PRESCRIPTION FOR {label.upper()} ===\nNo data available for this color."
@@ -137,7 +144,8 @@ def generate_prescription(phase_winrates_df: pd.DataFrame, label: str) -> str:
 # --------------------------------------------------
 
 def main():
-    df = pd.read_csv(IMB_PLAYER_CSV)
+    # only the columns used below; read from the .parquet twin when present
+    df = read_table(IMB_PLAYER_CSV, columns=["color_file", "phase", "error_type", "outcome"])
 
     # Sanity filter
     df = df[df["error_type"].isin(ERROR_TYPES)].copy()
@@ -1,5 +1,10 @@
+import argparse
+import resource
+
 import pandas as pd
 
+from TableIO import csv_to_parquet, open_chunks, read_table, require_parquet, write_parquet
+
 # --------------------------------------------------
 # CONFIG
 # --------------------------------------------------
@@ -10,96 +15,113 @@ OUTPUT_ERRORS_ONLY_CSV = "games_with_errors_only_imb.csv"
 # Error types of interest
 ERROR_TYPES = ["inaccuracy", "mistake", "blunder"]
 
-
-# --------------------------------------------------
-# LOAD DATA
-# --------------------------------------------------
-
-df = pd.read_csv(INPUT_CSV)
-
-# --------------------------------------------------
-# 1) FILTER BY COLOR FILE + SIDE
-# --------------------------------------------------
-# From white_file → only White moves
-white_df = df[(df["color_file"] == "white_file") & (df["side"] == "White")]
-
-# From black_file → only Black moves
-black_df = df[(df["color_file"] == "black_file") & (df["side"] == "Black")]
-
-# --------------------------------------------------
-# 2) TOTAL INACCURACIES, MISTAKES, BLUNDERS (WHITE & BLACK)
-# --------------------------------------------------
-
-white_counts = (
-    white_df[white_df["error_type"].isin(ERROR_TYPES)]["error_type"]
-    .value_counts()
-    .reindex(ERROR_TYPES, fill_value=0)
-)
-
-black_counts = (
-    black_df[black_df["error_type"].isin(ERROR_TYPES)]["error_type"]
-    .value_counts()
-    .reindex(ERROR_TYPES, fill_value=0)
-)
-
-print("=== TOTAL ERRORS – WHITE (from white_file, White moves only) ===")
-for et in ERROR_TYPES:
-    print(f"{et.capitalize()}: {white_counts[et]}")
-print()
-
-print("=== TOTAL ERRORS – BLACK (from black_file, Black moves only) ===")
-for et in ERROR_TYPES:
-    print(f"{et.capitalize()}: {black_counts[et]}")
-print()
-
-# --------------------------------------------------
-# 3) CREATE CSV WITH ONLY I/M/B
-# --------------------------------------------------
-
-errors_only_df = df[df["error_type"].isin(ERROR_TYPES)]
-errors_only_df.to_csv(OUTPUT_ERRORS_ONLY_CSV, index=False)
-print(f"Saved filtered errors CSV to: {OUTPUT_ERRORS_ONLY_CSV}")
-print()
-
-# --------------------------------------------------
-# 4) DEFINE GAME PHASE BY MOVE NUMBER
-# --------------------------------------------------
 # Simple phase rule:
 #   Opening:    move 1–15
 #   Middlegame: move 16–40
 #   Endgame:    move 41+
+PHASES = ["opening", "middlegame", "endgame"]
+PHASE_BINS = [float("-inf"), 15, 40, float("inf")]
+
+# which side the player is in each color file
+PLAYER_SIDE = {"white_file": "White", "black_file": "Black"}
+
+# --chunked: read the CSV in pieces with compact dtypes
+MEMORY_LIMIT_MB = 512   # peak memory to aim for, including the interpreter
+SAMPLE_ROWS = 10_000    # first chunk, used to measure bytes per row
+CHUNK_OVERHEAD = 4      # parser buffers + filtered copies per parsed chunk
+CHUNK_DTYPES = {
+    "game_id": "int32",
+    "color_file": "category",
+    "move_number": "int16",
+    "ply": "int16",
+    "side": "category",
+    "san": "category",
+    "uci": "category",
+    "best_cp": "int32",
+    "played_cp": "int32",
+    "cp_drop": "int32",
+    "error_type": "category",
+    "game_key": "category",
+}
+
+
+# --------------------------------------------------
+# HELPERS
+# --------------------------------------------------
+
+def assign_phases(move_number: pd.Series) -> pd.Series:
+    """Phase of every move at once, as a categorical (see PHASE_BINS)."""
+    return pd.cut(move_number, bins=PHASE_BINS, labels=PHASES)
+
+
+def player_error_counts(df: pd.DataFrame) -> pd.Series:
+    """
+    Count the player's errors per (color_file, phase, error_type) in one
+    groupby over categorical keys. Only White moves of the white file and
+    Black moves of the black file count. Every combination is present,
+    zeros included.
+    """
+    # errors are a small share of all moves, so filter on them first
+    errors = df.loc[df["error_type"].isin(ERROR_TYPES), ["color_file", "side", "move_number", "error_type"]]
+    # --chunked reads these as categoricals with per-chunk categories
+    errors = errors.astype({"color_file": object, "side": object, "error_type": object})
+    errors = errors[errors["side"] == errors["color_file"].map(PLAYER_SIDE)]
+    keys = pd.DataFrame({
+        "color_file": pd.Categorical(errors["color_file"], categories=list(PLAYER_SIDE)),
+        "phase": assign_phases(errors["move_number"]),
+        "error_type": pd.Categorical(errors["error_type"], categories=ERROR_TYPES),
+    })
+    return keys.groupby(["color_file", "phase", "error_type"], observed=False).size()
+
+
+def peak_memory_mb() -> float:
+    """Peak resident memory of this process so far (ru_maxrss is in KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def read_chunks(path: str, memory_limit_mb: float, columns: list = None):
+    """
+    Yield the CSV (or its Parquet twin) in chunks with CHUNK_DTYPES, only
+    `columns` if given. The first SAMPLE_ROWS rows show how much memory a
+    row takes; the remaining chunks are sized so that, with CHUNK_OVERHEAD
+    copies alive at once, the process stays under memory_limit_mb.
+    """
+    with open_chunks(path, dtype=CHUNK_DTYPES, columns=columns) as reader:
+        chunk = reader.get_chunk(SAMPLE_ROWS)
+        bytes_per_row = chunk.memory_usage(deep=True).sum() / max(len(chunk), 1)
+        budget = max(memory_limit_mb - peak_memory_mb(), memory_limit_mb / 4) * 2**20
+        rows = max(SAMPLE_ROWS, int(budget / (bytes_per_row * CHUNK_OVERHEAD)))
+
+        while True:
+            yield chunk
+            try:
+                chunk = reader.get_chunk(rows)
+            except StopIteration:
+                return
+
+
+def stream_counts(input_csv: str, errors_only_csv: str, memory_limit_mb: float) -> pd.Series:
+    """
+    --chunked: player_error_counts() summed over the chunks of input_csv.
+    The I/M/B rows of each chunk are appended to errors_only_csv as they go.
+    """
+    counts = None
+    for i, chunk in enumerate(read_chunks(input_csv, memory_limit_mb)):
+        chunk_counts = player_error_counts(chunk)
+        counts = chunk_counts if counts is None else counts + chunk_counts
+        chunk[chunk["error_type"].isin(ERROR_TYPES)].to_csv(
+            errors_only_csv, mode="w" if i == 0 else "a", header=i == 0, index=False
+        )
+    return counts
 
-def assign_phase(move_number: int) -> str:
-    if move_number <= 15:
-        return "opening"
-    elif move_number <= 40:
-        return "middlegame"
-    else:
-        return "endgame"
-
-white_df = white_df.copy()
-black_df = black_df.copy()
-
-white_df["phase"] = white_df["move_number"].apply(assign_phase)
-black_df["phase"] = black_df["move_number"].apply(assign_phase)
-
-# --------------------------------------------------
-# 5) COUNT ERRORS PER PHASE (WHITE & BLACK)
-# --------------------------------------------------
 
-def phase_error_counts(colored_df: pd.DataFrame, label: str):
-    phase_counts = (
-        colored_df[colored_df["error_type"].isin(ERROR_TYPES)]
-        .groupby(["phase", "error_type"])
-        .size()
-        .unstack(fill_value=0)
-        .reindex(index=["opening", "middlegame", "endgame"],
-                 columns=ERROR_TYPES,
-                 fill_value=0)
-    )
+def phase_error_counts(counts: pd.Series, color_file: str, label: str) -> pd.DataFrame:
+    phase_counts = counts.loc[color_file].unstack()
+    phase_counts.index = pd.Index(PHASES, name="phase")
+    phase_counts.columns = pd.Index(ERROR_TYPES, name="error_type")
 
     print(f"=== ERRORS BY PHASE – {label} ===")
-    for phase in ["opening", "middlegame", "endgame"]:
+    for phase in PHASES:
         row = phase_counts.loc[phase]
         print(
             f"{phase.capitalize():10s} | "
@@ -110,14 +132,99 @@ def phase_error_counts(colored_df: pd.DataFrame, label: str):
     print()
     return phase_counts
 
-white_phase_counts = phase_error_counts(white_df, "WHITE (white_file, White moves only)")
-black_phase_counts = phase_error_counts(black_df, "BLACK (black_file, Black moves only)")
 
 # --------------------------------------------------
-# (OPTIONAL) SAVE PHASE-WISE COUNTS TO CSV
+# RUN
 # --------------------------------------------------
-white_phase_counts.to_csv("white_phase_error_counts.csv")
-black_phase_counts.to_csv("black_phase_error_counts.csv")
-print("Saved phase-wise counts to:")
-print("  white_phase_error_counts.csv")
-print("  black_phase_error_counts.csv")
+
+def main():
+    parser = argparse.ArgumentParser(description="Count the player's errors by color and game phase.")
+    parser.add_argument("--chunked", action="store_true",
+                        help="read the CSV in chunks with compact dtypes instead of all at once")
+    parser.add_argument("--parquet", action="store_true",
+                        help="also write games_with_errors_only_imb.parquet (needs pyarrow)")
+    parser.add_argument("--memory-limit", type=float, default=MEMORY_LIMIT_MB, metavar="MB",
+                        help=f"with --chunked: peak memory to stay under (default: {MEMORY_LIMIT_MB})")
+    args = parser.parse_args()
+    if args.parquet:
+        require_parquet()
+
+    # --------------------------------------------------
+    # LOAD DATA + 1) COUNT PLAYER ERRORS BY COLOR FILE, PHASE AND TYPE (ONE PASS)
+    # --------------------------------------------------
+    # From white_file → only White moves
+    # From black_file → only Black moves
+
+    if args.chunked:
+        # the interpreter and pandas alone; chunks can only shrink what comes on top
+        baseline = peak_memory_mb()
+        # the I/M/B CSV is written chunk by chunk during the same pass
+        counts = stream_counts(INPUT_CSV, OUTPUT_ERRORS_ONLY_CSV, args.memory_limit)
+    else:
+        # games_with_errors.parquet is used instead when Clean.py wrote one
+        df = read_table(INPUT_CSV)
+        counts = player_error_counts(df)
+
+    # --------------------------------------------------
+    # 2) TOTAL INACCURACIES, MISTAKES, BLUNDERS (WHITE & BLACK)
+    # --------------------------------------------------
+
+    totals = counts.groupby(level=["color_file", "error_type"], observed=False).sum()
+    white_counts = totals.loc["white_file"]
+    black_counts = totals.loc["black_file"]
+
+    print("=== TOTAL ERRORS – WHITE (from white_file, White moves only) ===")
+    for et in ERROR_TYPES:
+        print(f"{et.capitalize()}: {white_counts[et]}")
+    print()
+
+    print("=== TOTAL ERRORS – BLACK (from black_file, Black moves only) ===")
+    for et in ERROR_TYPES:
+        print(f"{et.capitalize()}: {black_counts[et]}")
+    print()
+
+    # --------------------------------------------------
+    # 3) CREATE CSV WITH ONLY I/M/B
+    # --------------------------------------------------
+
+    if not args.chunked:
+        errors_only_df = df[df["error_type"].isin(ERROR_TYPES)]
+        errors_only_df.to_csv(OUTPUT_ERRORS_ONLY_CSV, index=False)
+    print(f"Saved filtered errors CSV to: {OUTPUT_ERRORS_ONLY_CSV}")
+    if args.parquet:
+        if args.chunked:
+            parquet_path = csv_to_parquet(OUTPUT_ERRORS_ONLY_CSV)
+        else:
+            parquet_path = write_parquet(errors_only_df, OUTPUT_ERRORS_ONLY_CSV)
+        print(f"Saved filtered errors Parquet to: {parquet_path}")
+    print()
+
+    # --------------------------------------------------
+    # 4) COUNT ERRORS PER PHASE (WHITE & BLACK)
+    # --------------------------------------------------
+
+    white_phase_counts = phase_error_counts(counts, "white_file", "WHITE (white_file, White moves only)")
+    black_phase_counts = phase_error_counts(counts, "black_file", "BLACK (black_file, Black moves only)")
+
+    # --------------------------------------------------
+    # (OPTIONAL) SAVE PHASE-WISE COUNTS TO CSV
+    # --------------------------------------------------
+    white_phase_counts.to_csv("white_phase_error_counts.csv")
+    black_phase_counts.to_csv("black_phase_error_counts.csv")
+    print("Saved phase-wise counts to:")
+    print("  white_phase_error_counts.csv")
+    print("  black_phase_error_counts.csv")
+
+    if args.chunked:
+        peak = peak_memory_mb()
+        print(f"\nPeak memory: {peak:.0f} MB (limit {args.memory_limit:.0f} MB, "
+              f"{baseline:.0f} MB before reading the CSV)")
+        if baseline > args.memory_limit:
+            print(f"Warning: the interpreter and libraries alone take {baseline:.0f} MB; "
+                  f"smaller chunks can't get under a limit below that, raise --memory-limit")
+        elif peak > args.memory_limit:
+            print("Warning: over the limit; lower --memory-limit to use smaller chunks")
+
+
+if __name__ == "__main__":
+    main()
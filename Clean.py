@@ -1,162 +1,1273 @@
-import chess
-import chess.pgn
-import chess.engine
-import csv
-from pathlib import Path
-
-# --------------------------------------------------
-# CONFIG
-# --------------------------------------------------
-
-STOCKFISH_PATH = Path(
-    "/usr/bin/stockfish"  # Fedora default path after: sudo dnf install stockfish
-    # Alternative paths for other systems:
-    # Ubuntu/Debian: "/usr/games/stockfish"
-    # macOS with Homebrew: "/opt/homebrew/bin/stockfish"
-)
-
-DEPTH_BEST = 10
-DEPTH_PLAYED = 8
-PROGRESS_EVERY = 10  # update terminal every N moves
-
-# --------------------------------------------------
-# ENGINE START (Linux compatible)
-# --------------------------------------------------
-
-engine = chess.engine.SimpleEngine.popen_uci(
-    str(STOCKFISH_PATH),
-    timeout=20
-    # Note: creationflags is Windows-specific, removed for Linux compatibility
-)
-
-engine.configure({
-    "Threads": 4,   # adjust if needed
-    "Hash": 512
-})
-
-# --------------------------------------------------
-# HELPERS
-# --------------------------------------------------
-
-def classify_delta(cp_drop):
-    if cp_drop < 50:
-        return "ok"
-    if cp_drop < 100:
-        return "inaccuracy"
-    if cp_drop < 300:
-        return "mistake"
-    return "blunder"
-
-
-def count_games_and_moves(pgn_path):
-    games = 0
-    moves = 0
-    with open(pgn_path, encoding="utf-8") as f:
-        while (game := chess.pgn.read_game(f)) is not None:
-            games += 1
-            moves += sum(1 for _ in game.mainline_moves())
-    return games, moves
-
-
-# --------------------------------------------------
-# MAIN ANALYSIS FUNCTION
-# --------------------------------------------------
-
-def analyse_pgn(pgn_path, color_label):
-    rows = []
-
-    total_games, total_moves = count_games_and_moves(pgn_path)
-    print(f"\nProcessing {pgn_path}")
-    print(f"Total games: {total_games}, total moves: {total_moves}\n")
-
-    processed_games = 0
-    processed_moves = 0
-
-    with open(pgn_path, encoding="utf-8") as f:
-        game_id = 0
-
-        while (game := chess.pgn.read_game(f)) is not None:
-            game_id += 1
-            processed_games += 1
-            board = game.board()
-
-            for ply, move in enumerate(game.mainline_moves(), start=1):
-                processed_moves += 1
-
-                player = board.turn  # side making the move
-
-                # ---- engine best evaluation BEFORE move ----
-                info_best = engine.analyse(
-                    board,
-                    chess.engine.Limit(depth=DEPTH_BEST)
-                )
-                best_score = info_best["score"].pov(player).score(mate_score=100000)
-
-                san = board.san(move)
-                uci = move.uci()
-
-                board.push(move)
-
-                # ---- evaluation AFTER played move ----
-                info_played = engine.analyse(
-                    board,
-                    chess.engine.Limit(depth=DEPTH_PLAYED)
-                )
-                played_score = info_played["score"].pov(player).score(mate_score=100000)
-
-                cp_drop = best_score - played_score
-                label = classify_delta(cp_drop)
-
-                side = "White" if player == chess.WHITE else "Black"
-                move_number = (ply + 1) // 2
-
-                rows.append({
-                    "game_id": game_id,
-                    "color_file": color_label,
-                    "move_number": move_number,
-                    "ply": ply,
-                    "side": side,
-                    "san": san,
-                    "uci": uci,
-                    "best_cp": best_score,
-                    "played_cp": played_score,
-                    "cp_drop": cp_drop,
-                    "error_type": label,
-                })
-
-                # ---- progress display ----
-                if processed_moves % PROGRESS_EVERY == 0 or processed_moves == total_moves:
-                    percent = (processed_moves / total_moves) * 100
-                    print(
-                        f"\rGames: {processed_games}/{total_games} | "
-                        f"Moves: {processed_moves}/{total_moves} "
-                        f"({percent:5.1f}%)",
-                        end=""
-                    )
-
-    print(f"\nFinished {pgn_path}")
-    return rows
-
-
-# --------------------------------------------------
-# RUN ANALYSIS
-# --------------------------------------------------
-
-white_rows = analyse_pgn("MAF13-white.pgn", "white_file")
-black_rows = analyse_pgn("MAF13-black.pgn", "black_file")
-
-# --------------------------------------------------
-# WRITE CSV
-# --------------------------------------------------
-
-with open("games_with_errors.csv", "w", newline="", encoding="utf-8") as f:
-    writer = csv.DictWriter(f, fieldnames=white_rows[0].keys())
-    writer.writeheader()
-    writer.writerows(white_rows + black_rows)
-
-# --------------------------------------------------
-# CLEAN SHUTDOWN
-# --------------------------------------------------
-
-engine.quit()
-print("\nAll done. CSV written to games_with_errors.csv")
+import argparse
+import asyncio
+import chess
+import chess.engine
+import chess.polyglot
+import chess.syzygy
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+from collections import Counter
+from multiprocessing.util import Finalize
+from pathlib import Path
+
+from EvalCache import CACHE_MAX_ENTRIES, CACHE_PATH, EvalCache
+from GameStore import GameStore
+from TableIO import csv_to_parquet, require_parquet
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+
+STOCKFISH_PATH = Path(
+    "/usr/bin/stockfish"  # Fedora default path after: sudo dnf install stockfish
+    # Alternative paths for other systems:
+    # Ubuntu/Debian: "/usr/games/stockfish"
+    # macOS with Homebrew: "/opt/homebrew/bin/stockfish"
+)
+
+DEPTH_SINGLE = 10   # one search per position (default mode)
+DEPTH_BEST = 10     # --compat: search before the move
+DEPTH_PLAYED = 8    # --compat: search after the move
+MULTIPV = 4         # --multipv: candidate moves scored by the pre-move search
+
+# --adaptive: search everything at ADAPTIVE_START_DEPTH first, then deepen by
+# ADAPTIVE_STEP up to --depth only where the label could still change
+ADAPTIVE_START_DEPTH = 6
+ADAPTIVE_STEP = 2
+ADAPTIVE_MARGIN = 30           # cp distance from a threshold that counts as "close"
+CP_THRESHOLDS = (50, 100, 300)  # boundaries used by classify_delta
+
+SYZYGY_PATH = None   # directory with Syzygy .rtbw/.rtbz files, or pass --syzygy
+TB_MAX_PIECES = 7    # largest tablebases that exist
+TB_WIN_CP = 20000    # score of a tablebase win (a loss is -TB_WIN_CP, a draw 0)
+
+DEDUP_BATCH = 2000   # --dedup: games whose positions are merged before searching
+DEDUP_CHUNK = 64     # --dedup: positions searched as one game (sent to a worker at a time with --workers)
+
+PROGRESS_EVERY = 10  # update terminal every N moves
+
+ENGINE_THREADS = 4   # adjust if needed
+ENGINE_HASH = 512    # MB, shared by all engines in pool mode
+
+MATE_SCORE = 100000
+
+PGN_FILES = [
+    ("MAF13-white.pgn", "white_file"),
+    ("MAF13-black.pgn", "black_file"),
+]
+
+# which side the player is in each color file (used by --player-only)
+PLAYER_COLOR = {
+    "white_file": chess.WHITE,
+    "black_file": chess.BLACK,
+}
+
+OUTPUT_CSV = "games_with_errors.csv"
+CHECKPOINT_PATH = "games_with_errors.checkpoint.json"
+
+FIELDNAMES = [
+    "game_id", "color_file", "move_number", "ply", "side", "san", "uci",
+    "best_cp", "played_cp", "cp_drop", "error_type", "game_key",
+]
+
+# headers that identify a game across re-exports (plus the moves themselves)
+GAME_KEY_HEADERS = ["Site", "Link", "UTCDate", "UTCTime", "White", "Black"]
+
+MAX_IN_FLIGHT_PER_WORKER = 4  # games queued ahead of each pool worker
+
+# --------------------------------------------------
+# ENGINE START (Linux compatible)
+# --------------------------------------------------
+
+def start_engine(threads=ENGINE_THREADS, hash_mb=ENGINE_HASH):
+    engine = chess.engine.SimpleEngine.popen_uci(
+        str(STOCKFISH_PATH),
+        timeout=20
+        # Note: creationflags is Windows-specific, removed for Linux compatibility
+    )
+
+    engine.configure({
+        "Threads": threads,
+        "Hash": hash_mb
+    })
+    return engine
+
+# --------------------------------------------------
+# HELPERS
+# --------------------------------------------------
+
+def classify_delta(cp_drop):
+    if cp_drop < 50:
+        return "ok"
+    if cp_drop < 100:
+        return "inaccuracy"
+    if cp_drop < 300:
+        return "mistake"
+    return "blunder"
+
+
+def iter_games(pgn_path, start_after=0):
+    """
+    Yield (index, headers, start_board, moves, bytes_read) per game of
+    pgn_path, where index is the 1-based position of the game in the file.
+    Games come from the PGN's parsed-game store (see GameStore.py), which is
+    built on first use, so the SAN of an export is only parsed once. The
+    first `start_after` games are skipped without decoding them.
+    """
+    yield from GameStore(pgn_path).iter_games(start_after)
+
+
+def game_key(headers, moves):
+    """Stable identifier of a game that survives re-exports and reordering."""
+    h = hashlib.sha1()
+    for tag in GAME_KEY_HEADERS:
+        h.update(headers.get(tag, "").encode("utf-8"))
+        h.update(b"|")
+    h.update(" ".join(move.uci() for move in moves).encode("ascii"))
+    return h.hexdigest()[:16]
+
+
+def load_known_games(csv_path):
+    """
+    Read the game_key / game_id columns of an existing output CSV and return
+    {color_file: (set of game keys, highest game_id)}.
+    """
+    known = {}
+    if not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0:
+        return known
+
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        if "game_key" not in header:
+            raise SystemExit(
+                f"{csv_path} has no game_key column (written by an older Clean.py); "
+                f"re-run without --incremental to rebuild it"
+            )
+        id_col = header.index("game_id")
+        color_col = header.index("color_file")
+        key_col = header.index("game_key")
+
+        last_key = None
+        for row in reader:
+            key = row[key_col]
+            if key == last_key:
+                continue  # rows of one game are contiguous
+            last_key = key
+            keys, max_id = known.get(row[color_col], (set(), 0))
+            keys.add(key)
+            known[row[color_col]] = (keys, max(max_id, int(row[id_col])))
+    return known
+
+
+# --------------------------------------------------
+# PER-GAME ANALYSIS
+# --------------------------------------------------
+
+def make_row(game_id, color_label, ply, player, san, uci, best_score, played_score):
+    cp_drop = best_score - played_score
+    return {
+        "game_id": game_id,
+        "color_file": color_label,
+        "move_number": (ply + 1) // 2,
+        "ply": ply,
+        "side": "White" if player == chess.WHITE else "Black",
+        "san": san,
+        "uci": uci,
+        "best_cp": best_score,
+        "played_cp": played_score,
+        "cp_drop": cp_drop,
+        "error_type": classify_delta(cp_drop),
+    }
+
+
+def shortcut_score(board, tablebase=None, skip_forced=True):
+    """
+    Score positions that need no search. Returns None if the engine has to
+    look at the position, otherwise (reason, score, child):
+
+    - "terminal": the game is over; score is mate or 0 like the engine gives
+    - "tablebase": the Syzygy WDL result as +/-TB_WIN_CP or 0
+    - "forced": only one legal move, so the position is worth exactly the
+      position after it; child is that position and score is None
+    """
+    outcome = board.outcome()
+    if outcome is not None:
+        if outcome.termination == chess.Termination.CHECKMATE:
+            return "terminal", chess.engine.PovScore(chess.engine.Mate(0), board.turn), None
+        return "terminal", chess.engine.PovScore(chess.engine.Cp(0), board.turn), None
+
+    if tablebase is not None and chess.popcount(board.occupied) <= TB_MAX_PIECES:
+        wdl = tablebase.get_wdl(board)
+        if wdl is not None:
+            # only the result: DTZ resets on every capture and pawn move, so it
+            # would make winning zeroing moves look like inaccuracies.
+            # Cursed wins and blessed losses are draws under the fifty-move rule
+            cp = TB_WIN_CP if wdl == 2 else -TB_WIN_CP if wdl == -2 else 0
+            return "tablebase", chess.engine.PovScore(chess.engine.Cp(cp), board.turn), None
+
+    if skip_forced and board.legal_moves.count() == 1:
+        child = board.copy()
+        child.push(next(iter(board.legal_moves)))
+        return "forced", None, child
+
+    return None
+
+
+def tablebase_covers(board, tablebase):
+    """Whether the tablebase has the board's position (its table is there and no castling rights are left)."""
+    return (
+        tablebase is not None
+        and chess.popcount(board.occupied) <= TB_MAX_PIECES
+        and tablebase.get_wdl(board) is not None
+    )
+
+
+def ply_uses_tablebase(board, move, tablebase):
+    """
+    Whether a ply is scored from the tablebase: only when the positions
+    before and after the move are both in it. Tablebase scores (about
+    TB_WIN_CP) and engine scores (a few hundred cp, or MATE_SCORE) are on
+    different scales, so one ply's cp_drop never mixes the two.
+    """
+    if not tablebase_covers(board, tablebase):
+        return False
+    board.push(move)
+    try:
+        return tablebase_covers(board, tablebase)
+    finally:
+        board.pop()
+
+
+def plan_game(color_label, board, moves, depth=DEPTH_SINGLE, compat=False, player_only=False, tablebase=None):
+    """
+    Work out which positions a game needs evaluated, without asking the engine.
+
+    Returns (jobs, plies). jobs lists the (board, depth, use_tablebase)
+    searches in the order they should run; every ply is (ply, player, san,
+    uci, before, after) with before/after indexing into jobs. Outside compat
+    mode the position after one ply is the same job as the position before
+    the next, unless only one of the two plies is scored from the
+    tablebase (see ply_uses_tablebase): then the position gets an engine
+    job and a tablebase job.
+    """
+    jobs = []
+    plies = []
+
+    def add_job(depth_, use_tablebase):
+        # no move stack: evaluations, the cache and --dedup only look at the
+        # position, and a copy of the stack per job made a plan quadratic
+        # in the game length
+        jobs.append((board.copy(stack=False), depth_, use_tablebase))
+        return len(jobs) - 1
+
+    current = None  # job of the current position, once planned
+    for ply, move in enumerate(moves, start=1):
+        player = board.turn  # side making the move
+
+        if player_only and player != PLAYER_COLOR[color_label]:
+            board.push(move)
+            current = None
+            continue
+
+        use_tablebase = ply_uses_tablebase(board, move, tablebase)
+        if compat:
+            before = add_job(DEPTH_BEST, use_tablebase)
+        else:
+            if current is None or jobs[current][2] != use_tablebase:
+                current = add_job(depth, use_tablebase)
+            before = current
+
+        san = board.san(move)
+        uci = move.uci()
+
+        board.push(move)
+        after = current = add_job(DEPTH_PLAYED if compat else depth, use_tablebase)
+
+        plies.append((ply, player, san, uci, before, after))
+
+    return jobs, plies
+
+
+def rows_from_plan(game_id, color_label, plies, scores):
+    """Build the output rows of a planned game from the scores of its jobs."""
+    return [
+        make_row(
+            game_id, color_label, ply, player, san, uci,
+            scores[before].pov(player).score(mate_score=MATE_SCORE),
+            scores[after].pov(player).score(mate_score=MATE_SCORE),
+        )
+        for ply, player, san, uci, before, after in plies
+    ]
+
+
+class GameAnalyser:
+    """
+    Turns one game into per-ply rows using a single engine.
+
+    Default mode evaluates every position once at `depth`: the evaluation
+    after ply N is reused as the evaluation before ply N+1. With compat=True
+    each ply gets the original DEPTH_BEST search before the move and a
+    DEPTH_PLAYED search after it.
+
+    With player_only=True only the plies of the player (PLAYER_COLOR of the
+    game's color file) get rows; opponent moves are pushed without asking
+    the engine, and only the positions around the player's moves are
+    evaluated. Adding multipv=K (K > 1) scores the played move straight from
+    the pre-move MultiPV search when it is one of the top K candidates, and
+    only searches the position after the move when it is not.
+
+    With adaptive=True positions are first searched shallow and only the
+    ones whose label is still in doubt are deepened up to `depth` (see
+    _analyse_adaptive). verify_every=N re-runs every Nth game at the fixed
+    depth and counts how many labels differ.
+
+    Before any search, evaluate() checks shortcut_score(): game-over
+    positions, Syzygy positions (when a tablebase is given and the ply is
+    scored from it, see ply_uses_tablebase) and positions with a single
+    legal move never reach the engine. The forced-move
+    shortcut is off in compat mode so those numbers stay as they were.
+
+    Every search is tagged with the current game (new_game()), so the engine
+    gets a ucinewgame and an empty hash table at the start of each game
+    instead of carrying over whatever the worker analysed before. With
+    Threads=1, the same Hash and no eval cache the rows of a game then don't
+    depend on which engine analysed it.
+
+    Counters for the end-of-run summary accumulate in `stats`; callers
+    collect them with take_stats() so pool workers can ship them back.
+    """
+
+    def __init__(self, engine, depth=DEPTH_SINGLE, compat=False, cache=None, player_only=False, multipv=1,
+                 adaptive=False, verify_every=0, tablebase=None):
+        self.engine = engine
+        self.depth = depth
+        self.compat = compat
+        self.cache = cache
+        self.player_only = player_only
+        self.multipv = multipv
+        self.adaptive = adaptive
+        self.verify_every = verify_every
+        self.tablebase = tablebase
+        self.stats = Counter()
+        # scores of positions reached through a forced move, for the next lookup
+        self._forced_children = {}
+        self._games = itertools.count()
+        self.game = None
+
+    def new_game(self):
+        """Start a new game: the next search clears the engine's hash table first."""
+        self.game = next(self._games)
+        self._forced_children.clear()
+
+    def take_stats(self):
+        stats, self.stats = self.stats, Counter()
+        return stats
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+        if self.tablebase is not None:
+            self.tablebase.close()
+        self.engine.quit()
+
+    def evaluate(self, board, depth, use_tablebase=False):
+        tablebase = self.tablebase if use_tablebase else None
+        shortcut = shortcut_score(board, tablebase, skip_forced=not self.compat)
+        if shortcut is not None:
+            reason, score, child = shortcut
+            self.stats[f"skipped_{reason}"] += 1
+            if child is not None:
+                score = self.evaluate(child, depth, use_tablebase)
+                self._forced_children[(chess.polyglot.zobrist_hash(child), depth)] = score
+            return score
+
+        if self._forced_children:
+            score = self._forced_children.pop((chess.polyglot.zobrist_hash(board), depth), None)
+            if score is not None:
+                return score
+
+        if self.cache is not None:
+            score = self.cache.get(board, depth)
+            if score is not None:
+                self.stats["cache_hits"] += 1
+                return score
+            self.stats["cache_misses"] += 1
+
+        info = self.engine.analyse(board, chess.engine.Limit(depth=depth), game=self.game)
+        self.stats["engine_searches"] += 1
+        score = info["score"]
+
+        if self.cache is not None:
+            self.cache.put(board, depth, score)
+        return score
+
+    def evaluate_positions(self, positions):
+        """Evaluate a list of (board, depth, use_tablebase) searches, e.g. a --dedup chunk, as one game."""
+        self.new_game()
+        return [self.evaluate(board, depth, use_tablebase) for board, depth, use_tablebase in positions]
+
+    def _wants(self, color_label, player):
+        """Whether the move of `player` needs an engine verdict."""
+        if not self.player_only:
+            return True
+        if player == PLAYER_COLOR[color_label]:
+            return True
+        self.stats["opponent_plies_skipped"] += 1
+        return False
+
+    def analyse_game(self, game_id, color_label, board, moves):
+        self.new_game()
+        if self.multipv > 1:
+            return self._analyse_multipv(game_id, color_label, board, moves)
+
+        jobs, plies = plan_game(color_label, board, moves, self.depth, self.compat, self.player_only,
+                                self.tablebase)
+        if self.player_only:
+            self.stats["opponent_plies_skipped"] += len(moves) - len(plies)
+
+        if self.adaptive:
+            rows = self._analyse_adaptive(game_id, color_label, jobs, plies)
+            if self.verify_every and game_id % self.verify_every == 0:
+                self._verify_adaptive(game_id, color_label, jobs, plies, rows)
+            return rows
+
+        scores = [self.evaluate(job_board, job_depth, use_tb) for job_board, job_depth, use_tb in jobs]
+        return rows_from_plan(game_id, color_label, plies, scores)
+
+    def _analyse_adaptive(self, game_id, color_label, jobs, plies):
+        """
+        Search every planned position at ADAPTIVE_START_DEPTH, then keep
+        deepening (by ADAPTIVE_STEP, up to self.depth) the positions of plies
+        whose cp_drop is within ADAPTIVE_MARGIN of a classify_delta threshold,
+        or whose evaluation moved by more than ADAPTIVE_MARGIN at the last
+        deepening. Everything else keeps its shallow score.
+        """
+        start = min(ADAPTIVE_START_DEPTH, self.depth)
+        depths = list(range(start, self.depth, ADAPTIVE_STEP)) + [self.depth]
+
+        job_depth = [depths[0]] * len(jobs)
+        scores = [self.evaluate(job_board, depths[0], use_tb) for job_board, _, use_tb in jobs]
+        self.stats[f"adaptive_depth_{depths[0]}"] += len(jobs)
+        moved = [False] * len(jobs)  # evaluation changed a lot at the last deepening
+
+        for depth in depths[1:]:
+            deepen = set()
+            for _ply, player, _san, _uci, before, after in plies:
+                best = scores[before].pov(player).score(mate_score=MATE_SCORE)
+                played = scores[after].pov(player).score(mate_score=MATE_SCORE)
+                cp_drop = best - played
+                close = any(abs(cp_drop - t) < ADAPTIVE_MARGIN for t in CP_THRESHOLDS)
+                if close or moved[before] or moved[after]:
+                    deepen.update(job for job in (before, after) if job_depth[job] < depth)
+            if not deepen:
+                break
+
+            for job in sorted(deepen):
+                old = scores[job].relative.score(mate_score=MATE_SCORE)
+                scores[job] = self.evaluate(jobs[job][0], depth, jobs[job][2])
+                new = scores[job].relative.score(mate_score=MATE_SCORE)
+                moved[job] = abs(new - old) > ADAPTIVE_MARGIN
+                job_depth[job] = depth
+            self.stats[f"adaptive_depth_{depth}"] += len(deepen)
+
+        return rows_from_plan(game_id, color_label, plies, scores)
+
+    def _verify_adaptive(self, game_id, color_label, jobs, plies, rows):
+        """Re-run a game at the fixed depth and count labels that differ from the adaptive run."""
+        self.new_game()
+        scores = [self.evaluate(job_board, self.depth, use_tb) for job_board, _, use_tb in jobs]
+        fixed_rows = rows_from_plan(game_id, color_label, plies, scores)
+        self.stats["adaptive_verified_plies"] += len(rows)
+        self.stats["adaptive_label_mismatches"] += sum(
+            a["error_type"] != b["error_type"] for a, b in zip(rows, fixed_rows)
+        )
+
+    def _analyse_multipv(self, game_id, color_label, board, moves):
+        rows = []
+
+        for ply, move in enumerate(moves, start=1):
+            player = board.turn  # side making the move
+
+            if not self._wants(color_label, player):
+                board.push(move)
+                continue
+
+            use_tablebase = ply_uses_tablebase(board, move, self.tablebase)
+            if shortcut_score(board, self.tablebase if use_tablebase else None) is not None:
+                # forced or tablebase position: no MultiPV search needed
+                best_score = self.evaluate(board, self.depth, use_tablebase)
+                san = board.san(move)
+                uci = move.uci()
+                board.push(move)
+                rows.append(make_row(
+                    game_id, color_label, ply, player, san, uci,
+                    best_score.pov(player).score(mate_score=MATE_SCORE),
+                    self.evaluate(board, self.depth, use_tablebase).pov(player).score(mate_score=MATE_SCORE),
+                ))
+                continue
+
+            # ---- one MultiPV search BEFORE the move ----
+            infos = self.engine.analyse(board, chess.engine.Limit(depth=self.depth), multipv=self.multipv,
+                                        game=self.game)
+            self.stats["engine_searches"] += 1
+            # not cached: a MultiPV search splits its effort over K lines, so its
+            # top score is not what a single-PV search at this depth returns
+            best_score = infos[0]["score"]
+
+            played_score = None
+            for rank, info in enumerate(infos, start=1):
+                pv = info.get("pv")
+                if pv and pv[0] == move:
+                    played_score = info["score"]
+                    self.stats[f"multipv_rank_{rank}"] += 1
+                    break
+
+            san = board.san(move)
+            uci = move.uci()
+
+            board.push(move)
+
+            # ---- played move outside the top K: search the position after it ----
+            if played_score is None:
+                self.stats["multipv_fallbacks"] += 1
+                played_score = self.evaluate(board, self.depth)
+
+            rows.append(make_row(
+                game_id, color_label, ply, player, san, uci,
+                best_score.pov(player).score(mate_score=MATE_SCORE),
+                played_score.pov(player).score(mate_score=MATE_SCORE),
+            ))
+
+        return rows
+
+
+# --------------------------------------------------
+# ENGINE POOL (one Stockfish per worker process)
+# --------------------------------------------------
+
+def open_tablebase(syzygy_path):
+    if not syzygy_path:
+        return None
+    tablebase = chess.syzygy.Tablebase()
+    for directory in syzygy_path.split(os.pathsep):
+        tablebase.add_directory(directory)
+    return tablebase
+
+
+def build_analyser(threads, hash_mb, options):
+    """
+    Start an engine (plus its eval cache and tablebases, if enabled) and
+    wrap it in a GameAnalyser.
+    """
+    engine = start_engine(threads, hash_mb)
+
+    cache = None
+    if options["cache_path"]:
+        cache = EvalCache(options["cache_path"], engine.id.get("name", ""), options["cache_max_entries"])
+
+    return GameAnalyser(engine, depth=options["depth"], compat=options["compat"], cache=cache,
+                        player_only=options["player_only"], multipv=options["multipv"],
+                        adaptive=options["adaptive"], verify_every=options["adaptive_verify"],
+                        tablebase=open_tablebase(options["syzygy_path"]))
+
+
+_worker_analyser = None
+
+
+def _init_worker(threads, hash_mb, options):
+    global _worker_analyser
+    _worker_analyser = build_analyser(threads, hash_mb, options)
+    # quit the engine when the pool shuts the worker down cleanly
+    Finalize(None, _worker_analyser.close, exitpriority=10)
+
+
+def _analyse_game_task(task):
+    args, meta = task
+    rows = _worker_analyser.analyse_game(*args)
+    return meta, rows, _worker_analyser.take_stats()
+
+
+def _evaluate_positions_task(positions):
+    scores = _worker_analyser.evaluate_positions(positions)
+    return scores, _worker_analyser.take_stats()
+
+
+# --------------------------------------------------
+# OUTPUT + CHECKPOINT
+# --------------------------------------------------
+
+class CheckpointedOutput:
+    """
+    Append-only CSV writer that records, after every game, how many games
+    of each PGN file are done and the CSV size at that point.
+
+    A restarted run truncates the CSV back to the checkpointed size (dropping
+    a half-written game) and carries on from the next game. With append=True
+    a fresh run keeps the existing CSV and adds to it.
+    """
+
+    def __init__(self, csv_path=OUTPUT_CSV, checkpoint_path=CHECKPOINT_PATH, options=None, resume=True,
+                 append=False):
+        self.csv_path = csv_path
+        self.checkpoint_path = checkpoint_path
+        self.state = {"options": options or {}, "output_bytes": 0, "files": {}}
+
+        if resume and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("options") != self.state["options"]:
+                raise SystemExit(
+                    f"{checkpoint_path} was written with different options "
+                    f"({saved.get('options')}); re-run with the same options or pass --restart"
+                )
+            self.state = saved
+            os.truncate(csv_path, saved["output_bytes"])
+            print(f"Resuming from {checkpoint_path}: {saved['files']}")
+        elif append and os.path.exists(csv_path):
+            self.state["output_bytes"] = os.path.getsize(csv_path)
+        else:
+            # fresh run: start a new CSV
+            open(csv_path, "w").close()
+
+        self.f = open(csv_path, "a", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.f, fieldnames=FIELDNAMES)
+        if self.state["output_bytes"] == 0:
+            self.writer.writeheader()
+
+    def games_done(self, pgn_path):
+        return self.state["files"].get(pgn_path, 0)
+
+    def write_game(self, pgn_path, index, rows):
+        self.writer.writerows(rows)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+        self.state["files"][pgn_path] = index
+        self.state["output_bytes"] = self.f.tell()
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def close(self, completed=False):
+        self.f.close()
+        if completed and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+
+def _bounded(iterable, slots):
+    """Yield from iterable, waiting for a free slot before each item."""
+    for item in iterable:
+        slots.acquire()
+        yield item
+
+
+# --------------------------------------------------
+# MAIN ANALYSIS FUNCTION
+# --------------------------------------------------
+
+class FileProgress:
+    """
+    One-line progress display for a PGN file. Progress is driven by how far
+    into the file the parser is, so the PGN only has to be read once.
+    """
+
+    def __init__(self, pgn_path, output):
+        self.total_bytes = os.path.getsize(pgn_path)
+        self.games = output.games_done(pgn_path)
+        self.moves = 0
+
+        print(f"\nProcessing {pgn_path} ({self.total_bytes / 1e6:.1f} MB)\n")
+        if self.games:
+            print(f"Skipping {self.games} games already in {output.csv_path}")
+
+    def game_done(self, n_rows, bytes_read):
+        self.games += 1
+        before = self.moves
+        self.moves += n_rows
+        if self.moves // PROGRESS_EVERY != before // PROGRESS_EVERY:
+            self.show(bytes_read)
+
+    def show(self, bytes_read):
+        percent = (bytes_read / self.total_bytes) * 100 if self.total_bytes else 100.0
+        print(
+            f"\rGames: {self.games} | "
+            f"Moves: {self.moves} "
+            f"({percent:5.1f}% of file)",
+            end=""
+        )
+
+    def finish(self):
+        self.show(self.total_bytes)
+
+
+def iter_new_games(pgn_path, color_label, start_after=0, known=None, run_stats=None, last_game=None):
+    """
+    Yield ((game_id, color_label, board, moves), (index, game_key, bytes_read))
+    for every game of pgn_path that still has to be analysed, up to game
+    number last_game if given.
+
+    If `known` is given as (set of game keys, highest game_id), games whose
+    key is already in the set are skipped and new games are numbered after
+    the highest existing game_id instead of by their position in the file.
+    """
+    if known is not None:
+        known_keys, last_id = known
+
+    for index, headers, board, moves, bytes_read in iter_games(pgn_path, start_after):
+        if last_game is not None and index > last_game:
+            return
+        key = game_key(headers, moves)
+        if known is None:
+            game_id = index
+        elif key in known_keys:
+            if run_stats is not None:
+                run_stats["games_already_analysed"] += 1
+            continue
+        else:
+            known_keys.add(key)
+            last_id += 1
+            game_id = last_id
+        yield (game_id, color_label, board, moves), (index, key, bytes_read)
+
+
+def plan_batch(games, options, tablebase=None):
+    """
+    Plan a batch of games from iter_new_games and merge their positions.
+
+    Returns (positions, planned). positions lists every unique (board, depth,
+    use_tablebase) search of the batch, keyed by Zobrist hash, depth and
+    use_tablebase; planned holds
+    (game_id, color_label, plies, slots, meta, n_moves) per game, where slots maps
+    each job of the game's plan to its index in positions.
+    """
+    positions = []
+    seen = {}
+    planned = []
+    for (game_id, color_label, board, moves), meta in games:
+        jobs, plies = plan_game(color_label, board, moves, options["depth"], options["compat"],
+                                options["player_only"], tablebase)
+        slots = []
+        for job_board, job_depth, use_tablebase in jobs:
+            key = (chess.polyglot.zobrist_hash(job_board), job_depth, use_tablebase)
+            if key not in seen:
+                seen[key] = len(positions)
+                positions.append((job_board, job_depth, use_tablebase))
+            slots.append(seen[key])
+        planned.append((game_id, color_label, plies, slots, meta, len(moves)))
+    return positions, planned
+
+
+def iter_dedup_results(tasks, options, batch_size, analyser=None, pool=None, run_stats=None):
+    """
+    --dedup: plan batch_size games at a time, search each unique position of
+    the batch once (on the analyser or spread over the pool), then fill in
+    every game's rows from those scores. Yields (meta, rows, stats) per game
+    in order, like the per-game paths of analyse_pgn.
+    """
+    tasks = iter(tasks)
+    # planning needs to know which plies the tablebase covers
+    tablebase = open_tablebase(options["syzygy_path"])
+    try:
+        while True:
+            batch = [task for _, task in zip(range(batch_size), tasks)]
+            if not batch:
+                return
+
+            positions, planned = plan_batch(batch, options, tablebase)
+            stats = Counter()
+            # each chunk is searched as one game, on one engine, in either mode
+            chunks = [positions[i:i + DEDUP_CHUNK] for i in range(0, len(positions), DEDUP_CHUNK)]
+            scores = []
+            if pool is not None:
+                for chunk_scores, chunk_stats in pool.imap(_evaluate_positions_task, chunks):
+                    scores.extend(chunk_scores)
+                    stats.update(chunk_stats)
+            else:
+                for chunk in chunks:
+                    scores.extend(analyser.evaluate_positions(chunk))
+                stats.update(analyser.take_stats())
+
+            stats["dedup_positions_planned"] += sum(len(slots) for _, _, _, slots, _, _ in planned)
+            stats["dedup_positions_unique"] += len(positions)
+            if options["player_only"]:
+                stats["opponent_plies_skipped"] += sum(n_moves - len(plies) for _, _, plies, _, _, n_moves in planned)
+            if run_stats is not None:
+                run_stats.update(stats)
+
+            for game_id, color_label, plies, slots, meta, _ in planned:
+                rows = rows_from_plan(game_id, color_label, plies, [scores[slot] for slot in slots])
+                yield meta, rows, Counter()
+    finally:
+        if tablebase is not None:
+            tablebase.close()
+
+
+def write_game(output, pgn_path, meta, rows):
+    index, key, _bytes_read = meta
+    for row in rows:
+        row["game_key"] = key
+    output.write_game(pgn_path, index, rows)
+
+
+def analyse_pgn(pgn_path, color_label, output, analyser=None, pool=None, max_in_flight=None,
+                known=None, run_stats=None, options=None, dedup_batch=0, games=None):
+    """
+    Analyse every game in pgn_path, either on a single engine or spread over
+    a worker pool, and append each game's rows to `output` as soon as it is
+    done. Rows always come back in game_id / ply order; engine and cache
+    counters are added to run_stats.
+
+    In pool mode at most max_in_flight games are parsed ahead of the
+    workers, so memory stays flat however large the PGN is. `known` is
+    passed on to iter_new_games for --incremental runs. With dedup_batch
+    set, games are analysed through iter_dedup_results instead. `games`
+    limits the run to the games numbered first..last (see Shards.py).
+    """
+    if run_stats is None:
+        run_stats = Counter()
+
+    first, last = games or (1, None)
+    progress = FileProgress(pgn_path, output)
+    start_after = max(output.games_done(pgn_path), first - 1)
+    tasks = iter_new_games(pgn_path, color_label, start_after, known, run_stats, last_game=last)
+
+    if dedup_batch:
+        slots = None
+        results = iter_dedup_results(tasks, options, dedup_batch, analyser, pool, run_stats)
+    elif pool is not None:
+        # imap keeps results in submission order, so output stays in game order.
+        # Its feeder thread would read the whole PGN ahead of the workers,
+        # so it has to wait for a free slot before queueing each game.
+        slots = threading.Semaphore(max_in_flight)
+        results = pool.imap(_analyse_game_task, _bounded(tasks, slots))
+    else:
+        slots = None
+        results = (
+            (meta, analyser.analyse_game(*args), analyser.take_stats())
+            for args, meta in tasks
+        )
+
+    try:
+        for meta, game_rows, game_stats in results:
+            if slots is not None:
+                slots.release()
+            write_game(output, pgn_path, meta, game_rows)
+            run_stats.update(game_stats)
+            progress.game_done(len(game_rows), meta[2])
+    finally:
+        if slots is not None:
+            # unblock the feeder thread so the pool can shut down
+            slots.release(max_in_flight)
+
+    progress.finish()
+    print(f"\nFinished {pgn_path}")
+
+
+# --------------------------------------------------
+# ASYNCIO DRIVER (several engines, one process)
+# --------------------------------------------------
+
+class AsyncEnginePool:
+    """
+    Several engines driven through python-chess' asyncio API from a single
+    process. evaluate() hands each search to whichever engine is free, so
+    as long as enough positions are queued every engine stays busy.
+
+    Searches are tagged with their game (new_game()), so an engine clears
+    its hash table whenever it moves on to another game. A game's positions
+    are still spread over several engines, so unlike the serial and pool
+    modes the rows can differ slightly from run to run.
+    """
+
+    def __init__(self):
+        self.engines = []
+        self.idle = asyncio.Queue()
+        self.cache = None
+        self.tablebase = None
+        self.skip_forced = True
+        self.stats = Counter()
+        self._games = itertools.count()
+        # game -> {(zobrist, depth): future} of positions reached through a forced move
+        self._forced_children = {}
+
+    async def start(self, n, threads, hash_mb, options):
+        for _ in range(n):
+            _transport, engine = await chess.engine.popen_uci(str(STOCKFISH_PATH))
+            await engine.configure({
+                "Threads": threads,
+                "Hash": hash_mb
+            })
+            self.engines.append(engine)
+            self.idle.put_nowait(engine)
+
+        if options["cache_path"]:
+            self.cache = EvalCache(options["cache_path"], self.engines[0].id.get("name", ""),
+                                   options["cache_max_entries"])
+        self.tablebase = open_tablebase(options["syzygy_path"])
+        self.skip_forced = not options["compat"]
+
+    def take_stats(self):
+        stats, self.stats = self.stats, Counter()
+        return stats
+
+    def new_game(self):
+        """Identifier to pass to evaluate() for every position of one game; end_game() forgets it."""
+        game = next(self._games)
+        self._forced_children[game] = {}
+        return game
+
+    def end_game(self, game):
+        self._forced_children.pop(game, None)
+
+    async def evaluate(self, board, depth, game=None, use_tablebase=False):
+        return await self._schedule(board, depth, game, use_tablebase)
+
+    def _schedule(self, board, depth, game, use_tablebase):
+        """
+        Future of the board's score, with the same shortcuts as
+        GameAnalyser.evaluate: a position with one legal move takes its
+        child's score, and the child's future is kept so the game's own job
+        for that position doesn't search it again. Nothing here awaits, so
+        a game's jobs register and look up in job order even though they
+        run concurrently.
+        """
+        shortcut = shortcut_score(board, self.tablebase if use_tablebase else None, self.skip_forced)
+        if shortcut is not None:
+            reason, score, child = shortcut
+            self.stats[f"skipped_{reason}"] += 1
+            if child is None:
+                future = asyncio.get_running_loop().create_future()
+                future.set_result(score)
+                return future
+            future = self._schedule(child, depth, game, use_tablebase)
+            if game in self._forced_children:
+                self._forced_children[game][(chess.polyglot.zobrist_hash(child), depth)] = future
+            return future
+
+        forced_children = self._forced_children.get(game)
+        if forced_children:
+            future = forced_children.pop((chess.polyglot.zobrist_hash(board), depth), None)
+            if future is not None:
+                return future
+        return asyncio.ensure_future(self._search(board, depth, game))
+
+    async def _search(self, board, depth, game):
+        if self.cache is not None:
+            score = self.cache.get(board, depth)
+            if score is not None:
+                self.stats["cache_hits"] += 1
+                return score
+            self.stats["cache_misses"] += 1
+
+        engine = await self.idle.get()
+        try:
+            info = await engine.analyse(board, chess.engine.Limit(depth=depth), game=game)
+        finally:
+            self.idle.put_nowait(engine)
+        self.stats["engine_searches"] += 1
+        score = info["score"]
+
+        if self.cache is not None:
+            self.cache.put(board, depth, score)
+        return score
+
+    async def close(self):
+        for engine in self.engines:
+            await engine.quit()
+        if self.cache is not None:
+            self.cache.close()
+        if self.tablebase is not None:
+            self.tablebase.close()
+
+
+async def analyse_pgn_async(pgn_path, color_label, output, engines, options, max_in_flight,
+                            known=None, run_stats=None):
+    """
+    asyncio counterpart of analyse_pgn. Up to max_in_flight games are planned
+    ahead and all of their positions are queued on the engine pool at once.
+    Parsing and CSV writes run in worker threads so the event loop keeps
+    feeding the engines meanwhile. Rows are still written in game order.
+    """
+    if run_stats is None:
+        run_stats = Counter()
+
+    progress = FileProgress(pgn_path, output)
+    games = iter_new_games(pgn_path, color_label, output.games_done(pgn_path), known, run_stats)
+    pending = asyncio.Queue(maxsize=max_in_flight)
+
+    async def analyse(game_id, color_label, board, moves):
+        jobs, plies = plan_game(color_label, board, moves, options["depth"], options["compat"],
+                                options["player_only"], engines.tablebase)
+        if options["player_only"]:
+            run_stats["opponent_plies_skipped"] += len(moves) - len(plies)
+        game = engines.new_game()
+        try:
+            scores = await asyncio.gather(*(engines.evaluate(b, d, game, tb) for b, d, tb in jobs))
+        finally:
+            engines.end_game(game)
+        return rows_from_plan(game_id, color_label, plies, scores)
+
+    async def produce():
+        try:
+            while (item := await asyncio.to_thread(next, games, None)) is not None:
+                args, meta = item
+                await pending.put((meta, asyncio.create_task(analyse(*args))))
+        finally:
+            # a parse error must still end the loop below, where `await producer` re-raises it
+            await pending.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (entry := await pending.get()) is not None:
+            meta, task = entry
+            game_rows = await task
+            await asyncio.to_thread(write_game, output, pgn_path, meta, game_rows)
+            progress.game_done(len(game_rows), meta[2])
+        await producer
+    finally:
+        producer.cancel()
+        while not pending.empty():
+            entry = pending.get_nowait()
+            if entry is not None:
+                entry[1].cancel()
+
+    run_stats.update(engines.take_stats())
+    progress.finish()
+    print(f"\nFinished {pgn_path}")
+
+
+async def analyse_all_async(output, workers, threads, hash_mb, options, known_games, run_stats):
+    engines = AsyncEnginePool()
+    await engines.start(workers, threads, hash_mb, options)
+    try:
+        for pgn_path, color_label in PGN_FILES:
+            known = known_games.get(color_label, (set(), 0)) if known_games is not None else None
+            await analyse_pgn_async(pgn_path, color_label, output, engines, options,
+                                    workers * MAX_IN_FLIGHT_PER_WORKER, known, run_stats)
+    finally:
+        await engines.close()
+
+
+def print_run_summary(run_stats):
+    print("\n=== RUN SUMMARY ===")
+    print(f"Engine searches: {run_stats['engine_searches']}")
+
+    skipped = {reason: run_stats[f"skipped_{reason}"] for reason in ("terminal", "forced", "tablebase")}
+    if any(skipped.values()):
+        print(
+            f"Positions scored without the engine: {skipped['terminal']} game over, "
+            f"{skipped['forced']} single legal move, {skipped['tablebase']} tablebase"
+        )
+    if run_stats["dedup_positions_unique"]:
+        planned = run_stats["dedup_positions_planned"]
+        unique = run_stats["dedup_positions_unique"]
+        print(
+            f"Dedup: {planned} positions planned, {unique} unique "
+            f"(ratio {planned / unique:.2f}, {planned - unique} searches saved)"
+        )
+    if run_stats["opponent_plies_skipped"]:
+        print(f"Opponent plies skipped (--player-only): {run_stats['opponent_plies_skipped']}")
+
+    ranks = sorted(
+        (int(name.rsplit("_", 1)[1]), count)
+        for name, count in run_stats.items() if name.startswith("multipv_rank_")
+    )
+    if ranks or run_stats["multipv_fallbacks"]:
+        scored = sum(count for _, count in ranks) + run_stats["multipv_fallbacks"]
+        print(
+            f"MultiPV: {scored - run_stats['multipv_fallbacks']} moves scored from the PV list, "
+            f"{run_stats['multipv_fallbacks']} fallback searches "
+            f"({run_stats['multipv_fallbacks'] / scored * 100:5.1f}% fallback rate)"
+        )
+        # how often the played move was the k-th candidate, to help tune --multipv
+        covered = 0
+        for rank, count in ranks:
+            covered += count
+            print(f"  rank {rank}: {count:8d}  (top {rank} covers {covered / scored * 100:5.1f}%)")
+
+    adaptive = sorted(
+        (int(name.rsplit("_", 1)[1]), count)
+        for name, count in run_stats.items() if name.startswith("adaptive_depth_")
+    )
+    if adaptive:
+        print("Adaptive depth: positions searched per depth")
+        for depth, count in adaptive:
+            print(f"  depth {depth:2d}: {count:8d}")
+    if run_stats["adaptive_verified_plies"]:
+        verified = run_stats["adaptive_verified_plies"]
+        mismatches = run_stats["adaptive_label_mismatches"]
+        print(
+            f"Adaptive check: {mismatches} of {verified} labels differ from the fixed-depth run "
+            f"({mismatches / verified * 100:5.2f}% tolerance)"
+        )
+    if run_stats["games_already_analysed"]:
+        print(f"Games skipped (already in output): {run_stats['games_already_analysed']}")
+
+    lookups = run_stats["cache_hits"] + run_stats["cache_misses"]
+    if lookups:
+        hit_rate = run_stats["cache_hits"] / lookups * 100
+        print(
+            f"Eval cache: {run_stats['cache_hits']} hits, "
+            f"{run_stats['cache_misses']} misses ({hit_rate:5.1f}% hit rate)"
+        )
+
+
+# --------------------------------------------------
+# RUN ANALYSIS
+# --------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Label every move in the PGN files with Stockfish.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of Stockfish processes to run in parallel (default: 1)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Threads per engine (default: ENGINE_THREADS, or 1 in pool mode); "
+                             "use 1 when the rows must not depend on --workers")
+    parser.add_argument("--hash", type=int, default=None,
+                        help="Hash MB per engine (default: ENGINE_HASH split across workers)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="drive the --workers engines from this one process with asyncio "
+                             "instead of a process pool")
+    parser.add_argument("--depth", type=int, default=DEPTH_SINGLE,
+                        help=f"search depth for the one-evaluation-per-position mode (default: {DEPTH_SINGLE})")
+    parser.add_argument("--compat", action="store_true",
+                        help=f"search twice per ply (depth {DEPTH_BEST} before, {DEPTH_PLAYED} after) "
+                             "to reproduce the original numbers")
+    parser.add_argument("--player-only", action="store_true",
+                        help="only analyse the player's own moves (White in white_file, Black in black_file)")
+    parser.add_argument("--multipv", type=int, nargs="?", const=MULTIPV, default=1, metavar="K",
+                        help=f"with --player-only: score the played move from a MultiPV search of the top K "
+                             f"moves (default K: {MULTIPV}) and only search again when it is not among them")
+    parser.add_argument("--adaptive", action="store_true",
+                        help=f"search every position at depth {ADAPTIVE_START_DEPTH} first and only deepen "
+                             f"(up to --depth) where cp_drop is within {ADAPTIVE_MARGIN} cp of a label "
+                             f"threshold or the evaluation is unstable")
+    parser.add_argument("--adaptive-verify", type=int, default=0, metavar="N",
+                        help="with --adaptive: also analyse every Nth game at the fixed depth and report "
+                             "how many labels differ")
+    parser.add_argument("--dedup", type=int, nargs="?", const=DEDUP_BATCH, default=0, metavar="N",
+                        help=f"plan N games at a time (default N: {DEDUP_BATCH}) and search each position "
+                             "they share only once")
+    parser.add_argument("--syzygy", default=SYZYGY_PATH, metavar="DIR",
+                        help="Syzygy tablebase directory (several separated by '" + os.pathsep + "'); "
+                             "positions it covers are scored without the engine")
+    parser.add_argument("--cache", default=CACHE_PATH,
+                        help=f"SQLite file for cached evaluations (default: {CACHE_PATH})")
+    parser.add_argument("--cache-max-entries", type=int, default=CACHE_MAX_ENTRIES,
+                        help="evict least recently used evaluations past this many entries")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always ask the engine, never read or write the eval cache")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH,
+                        help=f"progress file used to resume an interrupted run (default: {CHECKPOINT_PATH})")
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore any checkpoint and analyse every game from scratch")
+    parser.add_argument("--parquet", action="store_true",
+                        help=f"when the run is complete, also write {OUTPUT_CSV} as typed Parquet (needs pyarrow)")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"keep {OUTPUT_CSV} and only analyse games that are not in it yet")
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.parquet:
+        require_parquet()
+    if args.multipv > 1 and (args.compat or not args.player_only):
+        # without --player-only every position is already searched exactly once,
+        # and --compat has to keep the original two searches
+        parser.error("--multipv needs --player-only and cannot be combined with --compat")
+    if args.use_async and args.multipv > 1:
+        parser.error("--async cannot be combined with --multipv")
+    if args.dedup and (args.multipv > 1 or args.adaptive or args.use_async):
+        parser.error("--dedup cannot be combined with --multipv, --adaptive or --async")
+    if args.adaptive and (args.compat or args.multipv > 1 or args.use_async):
+        parser.error("--adaptive cannot be combined with --compat, --multipv or --async")
+
+    if args.workers == 1:
+        threads = args.threads or ENGINE_THREADS
+        hash_mb = args.hash or ENGINE_HASH
+    else:
+        threads = args.threads or 1
+        hash_mb = args.hash or max(16, ENGINE_HASH // args.workers)
+
+    options = {
+        "depth": args.depth,
+        "compat": args.compat,
+        "player_only": args.player_only,
+        "multipv": args.multipv,
+        "adaptive": args.adaptive,
+        "adaptive_verify": args.adaptive_verify,
+        "syzygy_path": args.syzygy,
+        "cache_path": None if args.no_cache else args.cache,
+        "cache_max_entries": args.cache_max_entries,
+    }
+
+    # only the options that change the numbers have to match on resume
+    output = CheckpointedOutput(
+        OUTPUT_CSV, args.checkpoint,
+        options={"depth": args.depth, "compat": args.compat, "player_only": args.player_only,
+                 "multipv": args.multipv, "adaptive": args.adaptive, "syzygy": bool(args.syzygy),
+                 "incremental": args.incremental},
+        resume=not args.restart,
+        append=args.incremental,
+    )
+    known_games = load_known_games(OUTPUT_CSV) if args.incremental else {}
+
+    analyser = None
+    pool = None
+    if args.use_async:
+        print(f"Driving {args.workers} engines with asyncio ({threads} threads, {hash_mb} MB hash each)")
+    elif args.workers == 1:
+        analyser = build_analyser(threads, hash_mb, options)
+    else:
+        print(f"Starting {args.workers} engines ({threads} threads, {hash_mb} MB hash each)")
+        pool = multiprocessing.Pool(args.workers, initializer=_init_worker,
+                                    initargs=(threads, hash_mb, options))
+
+    # rows are appended to the CSV game by game, nothing is held in memory
+    run_stats = Counter()
+    try:
+        if args.use_async:
+            asyncio.run(analyse_all_async(output, args.workers, threads, hash_mb, options,
+                                          known_games if args.incremental else None, run_stats))
+        else:
+            for pgn_path, color_label in PGN_FILES:
+                known = known_games.get(color_label, (set(), 0)) if args.incremental else None
+                analyse_pgn(pgn_path, color_label, output, analyser=analyser, pool=pool,
+                            max_in_flight=args.workers * MAX_IN_FLIGHT_PER_WORKER,
+                            known=known, run_stats=run_stats, options=options,
+                            dedup_batch=args.dedup)
+    except BaseException:
+        # keep the checkpoint so the next run resumes from here, and don't
+        # leave worker processes (and their engines) waiting on a dead parent
+        output.close()
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        # the engine's I/O thread would keep the process alive otherwise
+        if analyser is not None:
+            analyser.close()
+
+    # --------------------------------------------------
+    # CLEAN SHUTDOWN
+    # --------------------------------------------------
+
+    output.close(completed=True)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    print_run_summary(run_stats)
+    print(f"\nAll done. CSV written to {OUTPUT_CSV}")
+    if args.parquet:
+        print(f"Parquet written to {csv_to_parquet(OUTPUT_CSV)}")
+
+
+if __name__ == "__main__":
+    main()
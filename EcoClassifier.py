@@ -0,0 +1,112 @@
+import csv
+import glob
+import json
+import os
+
+import chess
+import chess.polyglot
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+
+# ECO database: the a.tsv ... e.tsv files of https://github.com/lichess-org/chess-openings
+# (columns eco, name, pgn; the generated dist files with a uci column work too)
+ECO_DIR = "eco"
+ECO_TABLE = "eco_positions.json"  # compiled position table, rebuilt when the TSVs change
+
+
+# --------------------------------------------------
+# HELPERS
+# --------------------------------------------------
+
+def _tsv_stamps(tsv_paths):
+    stamps = {}
+    for path in tsv_paths:
+        st = os.stat(path)
+        stamps[os.path.basename(path)] = [st.st_size, st.st_mtime_ns]
+    return stamps
+
+
+def iter_eco_lines(tsv_paths):
+    """Yield (eco, name, moves) for every line of the ECO database files."""
+    for path in tsv_paths:
+        with open(path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f, delimiter="\t"):
+                board = chess.Board()
+                if row.get("uci"):
+                    moves = [chess.Move.from_uci(uci) for uci in row["uci"].split()]
+                else:
+                    # "1. e4 e5 2. Nf3": drop the move numbers, parse the SAN
+                    moves = []
+                    for token in row["pgn"].split():
+                        if token.endswith("."):
+                            continue
+                        moves.append(board.push_san(token))
+                yield row["eco"], row["name"], moves
+
+
+def compile_table(tsv_paths):
+    """
+    Map the Zobrist hash of every position the ECO lines end in to
+    [eco, name, plies]. A position reached by several lines keeps the
+    shortest one, so transpositions land on the main line's name.
+    """
+    table = {}
+    for eco, name, moves in iter_eco_lines(tsv_paths):
+        board = chess.Board()
+        for move in moves:
+            board.push(move)
+        key = str(chess.polyglot.zobrist_hash(board))
+        if key not in table or len(moves) < table[key][2]:
+            table[key] = [eco, name, len(moves)]
+    return table
+
+
+# --------------------------------------------------
+# CLASSIFIER
+# --------------------------------------------------
+
+class EcoClassifier:
+    """
+    Names openings from the moves actually played.
+
+    The ECO database is compiled once into a Zobrist-keyed position table
+    (saved to ECO_TABLE and rebuilt when the TSV files change). classify()
+    walks a game's first moves with one dictionary lookup per ply and keeps
+    the deepest position found in the table, so move-order transpositions
+    get the same name.
+    """
+
+    def __init__(self, eco_dir=ECO_DIR, table_path=ECO_TABLE, rebuild=False):
+        tsv_paths = sorted(glob.glob(os.path.join(eco_dir, "*.tsv")))
+        if not tsv_paths:
+            raise FileNotFoundError(f"no ECO database (*.tsv) found in {eco_dir}")
+
+        stamps = _tsv_stamps(tsv_paths)
+        table = None
+        if not rebuild and os.path.exists(table_path):
+            with open(table_path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("sources") == stamps:
+                table = saved["positions"]
+
+        if table is None:
+            table = compile_table(tsv_paths)
+            tmp_path = table_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"sources": stamps, "positions": table}, f)
+            os.replace(tmp_path, table_path)
+
+        self.positions = {int(key): (eco, name) for key, (eco, name, _plies) in table.items()}
+        # no line is longer than this, so there is no point walking further
+        self.max_plies = max((plies for _eco, _name, plies in table.values()), default=0)
+
+    def classify(self, board, moves):
+        """Return (eco, name) of the deepest known position in the game, or ("", "")."""
+        board = board.copy(stack=False)
+        found = ("", "")
+        for move in moves[:self.max_plies]:
+            board.push(move)
+            found = self.positions.get(chess.polyglot.zobrist_hash(board), found)
+        return found
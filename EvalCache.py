@@ -0,0 +1,162 @@
+import sqlite3
+
+import chess
+import chess.engine
+import chess.polyglot
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+
+CACHE_PATH = "eval_cache.sqlite"
+CACHE_MAX_ENTRIES = 5_000_000   # oldest-used entries are evicted past this
+FLUSH_EVERY = 500               # buffered writes per (short) transaction
+RECOUNT_EVERY = 200             # flushes between real row counts (other processes' rows show up then)
+
+
+# --------------------------------------------------
+# HELPERS
+# --------------------------------------------------
+
+def position_key(board: chess.Board) -> int:
+    """Zobrist hash of the position, folded into SQLite's signed 64-bit range."""
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+# --------------------------------------------------
+# CACHE
+# --------------------------------------------------
+
+class EvalCache:
+    """
+    On-disk store of engine evaluations keyed by (Zobrist hash, depth, engine).
+
+    Scores are stored relative to the side to move, so a hit can be turned
+    back into a PovScore for any board with the same key. Several processes
+    may share one file: writes are buffered in memory and flushed in short
+    transactions so no writer holds the lock across engine searches.
+    """
+
+    def __init__(self, path=CACHE_PATH, engine_name="", max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.engine_name = engine_name
+        self.max_entries = max_entries
+        self._puts = {}      # (key, depth) -> row not yet written
+        self._touches = []
+        self._clock = 0
+        self._flushes = 0
+
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS evals (
+                key INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                engine TEXT NOT NULL,
+                cp INTEGER,
+                mate INTEGER,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (key, depth, engine)
+            ) WITHOUT ROWID
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS evals_last_used ON evals (last_used)")
+        self.conn.commit()
+        # continue the LRU clock from where the previous run stopped
+        self._clock = self.conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM evals").fetchone()[0]
+        # running row count, so evict() doesn't have to scan the table on every flush
+        self._rows = self.size()
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def get(self, board, depth):
+        key = position_key(board)
+        pending = self._puts.get((key, depth))
+        if pending is not None:
+            return self._to_pov_score(pending[3], pending[4], board)
+
+        row = self.conn.execute(
+            "SELECT cp, mate FROM evals WHERE key = ? AND depth = ? AND engine = ?",
+            (key, depth, self.engine_name),
+        ).fetchone()
+        if row is None:
+            return None
+
+        self._touches.append((self._tick(), key, depth, self.engine_name))
+        self._maybe_flush()
+
+        return self._to_pov_score(*row, board)
+
+    @staticmethod
+    def _to_pov_score(cp, mate, board):
+        score = chess.engine.Mate(mate) if mate is not None else chess.engine.Cp(cp)
+        return chess.engine.PovScore(score, board.turn)
+
+    def put(self, board, depth, pov_score):
+        relative = pov_score.relative
+        if relative.is_mate():
+            cp, mate = None, relative.mate()
+        else:
+            cp, mate = relative.score(), None
+
+        key = position_key(board)
+        self._puts[(key, depth)] = (key, depth, self.engine_name, cp, mate, self._tick())
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self._puts) + len(self._touches) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO evals (key, depth, engine, cp, mate, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                list(self._puts.values()),
+            )
+            self.conn.executemany(
+                "UPDATE evals SET last_used = ? WHERE key = ? AND depth = ? AND engine = ?",
+                self._touches,
+            )
+        # puts follow cache misses, so nearly all of them are new rows
+        self._rows += len(self._puts)
+        self._flushes += 1
+        self._puts = {}
+        self._touches = []
+        self.evict()
+
+    def evict(self):
+        """
+        Drop the least recently used entries once the table is over max_entries.
+
+        The table is only counted when the running count says it may be too
+        big, or every RECOUNT_EVERY flushes to take in rows written by other
+        processes sharing the file.
+        """
+        if self._rows <= self.max_entries and self._flushes % RECOUNT_EVERY:
+            return 0
+        self._rows = self.size()
+        excess = self._rows - self.max_entries
+        if excess <= 0:
+            return 0
+        # trim a little below the limit so we don't evict on every commit
+        excess += self.max_entries // 10
+        with self.conn:
+            deleted = self.conn.execute(
+                "DELETE FROM evals WHERE (key, depth, engine) IN "
+                "(SELECT key, depth, engine FROM evals ORDER BY last_used LIMIT ?)",
+                (excess,),
+            ).rowcount
+        self._rows -= deleted
+        return deleted
+
+    def size(self):
+        return self.conn.execute("SELECT COUNT(*) FROM evals").fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,244 @@
+import io
+import os
+import sys
+from array import array
+
+import chess
+import chess.pgn
+import numpy as np
+
+from PgnIndex import INDEX_HEADERS, PgnIndex
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+
+STORE_SUFFIX = ".games.npz"  # sidecar written next to each PGN
+
+# header columns kept in the store (FEN holds the starting position of
+# games that don't start from the initial position; Event/Date/Round tell
+# apart OTB games, which have no Site link or UTC time)
+STORE_HEADERS = INDEX_HEADERS + ["Event", "Date", "Round", "FEN"]
+
+PGN_FILES = ["MAF13-white.pgn", "MAF13-black.pgn"]
+
+
+# --------------------------------------------------
+# HELPERS
+# --------------------------------------------------
+
+class MainlineVisitor(chess.pgn.BaseVisitor):
+    """
+    PGN visitor that keeps only the headers, the starting board and the
+    mainline moves. Variations are skipped by the parser and no GameNode
+    tree is built.
+    """
+
+    def begin_game(self):
+        self.headers = {}
+        self.board = None
+        self.moves = []
+        self.errors = []
+
+    def visit_header(self, tagname, tagvalue):
+        self.headers[tagname] = tagvalue
+
+    def visit_board(self, board):
+        if self.board is None:
+            self.board = board.copy(stack=False)
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_move(self, board, move):
+        self.moves.append(move)
+
+    def handle_error(self, error):
+        self.errors.append(error)
+
+    def result(self):
+        return self
+
+
+def encode_move(move):
+    """Pack a move into 16 bits: from (6) | to (6) | promotion piece type (3)."""
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def decode_move(code):
+    promotion = (code >> 12) & 7
+    return chess.Move(code & 63, (code >> 6) & 63, promotion or None)
+
+
+def store_path_for(pgn_path):
+    return str(pgn_path) + STORE_SUFFIX
+
+
+def _pgn_stamp(pgn_path):
+    st = os.stat(pgn_path)
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def _store_matches(saved, stamp):
+    """A saved store is usable if the PGN hasn't changed and it has every STORE_HEADERS column."""
+    return np.array_equal(saved["pgn_stamp"], stamp) and all(
+        f"codes_{tag}" in saved.files for tag in STORE_HEADERS
+    )
+
+
+def store_is_fresh(pgn_path, store_path=None):
+    """Whether pgn_path already has a store matching its current size and mtime."""
+    store_path = store_path or store_path_for(pgn_path)
+    if not os.path.exists(store_path):
+        return False
+    with np.load(store_path) as saved:
+        return _store_matches(saved, _pgn_stamp(pgn_path))
+
+
+# --------------------------------------------------
+# STORE
+# --------------------------------------------------
+
+class GameStore:
+    """
+    Parsed games of one PGN file in flat numpy arrays, saved as an .npz
+    sidecar so the SAN is parsed only once per export.
+
+    - moves: every mainline move of every game as uint16 (see encode_move)
+    - move_offsets: game i's moves are moves[move_offsets[i]:move_offsets[i + 1]]
+    - game_no: 1-based position of each game in the PGN (unreadable games
+      are left out, so numbers can have gaps)
+    - byte_end: where each game ends in the PGN, for progress reporting
+    - per header in STORE_HEADERS: int32 codes into a table of distinct values
+
+    Like PgnIndex, the store remembers the PGN's size and mtime and is
+    rebuilt when the PGN changes, or when it was saved without one of the
+    STORE_HEADERS columns.
+    """
+
+    def __init__(self, pgn_path, store_path=None, rebuild=False):
+        self.pgn_path = str(pgn_path)
+        self.store_path = store_path or store_path_for(pgn_path)
+
+        stamp = _pgn_stamp(self.pgn_path)
+        arrays = None
+        if not rebuild and os.path.exists(self.store_path):
+            with np.load(self.store_path) as saved:
+                if _store_matches(saved, stamp):
+                    arrays = dict(saved)
+
+        self.rebuilt = arrays is None
+        if self.rebuilt:
+            arrays = self._build(stamp)
+            self._save(arrays)
+
+        self.moves = arrays["moves"]
+        self.move_offsets = arrays["move_offsets"]
+        self.game_no = arrays["game_no"]
+        self.byte_end = arrays["byte_end"]
+        self.header_codes = {tag: arrays[f"codes_{tag}"] for tag in STORE_HEADERS}
+        self.header_values = {tag: arrays[f"values_{tag}"].tolist() for tag in STORE_HEADERS}
+
+    def _build(self, stamp):
+        index = PgnIndex(self.pgn_path)
+
+        moves = array("H")
+        move_offsets = [0]
+        game_no = []
+        byte_end = []
+        values = {tag: {"": 0} for tag in STORE_HEADERS}
+        codes = {tag: [] for tag in STORE_HEADERS}
+
+        with open(self.pgn_path, "rb") as f:
+            for number, (offset, length, _headers) in enumerate(index.games, start=1):
+                f.seek(offset)
+                text = f.read(length).decode("utf-8")
+                game = chess.pgn.read_game(io.StringIO(text), Visitor=MainlineVisitor)
+                if game is None:
+                    continue
+                for error in game.errors:
+                    print(f"\nWarning: {self.pgn_path} game {number}: {error}")
+                if game.board is None:
+                    continue
+
+                headers = dict(game.headers)
+                fen = game.board.fen()
+                headers["FEN"] = "" if fen == chess.STARTING_FEN else fen
+                for tag in STORE_HEADERS:
+                    table = values[tag]
+                    codes[tag].append(table.setdefault(headers.get(tag, ""), len(table)))
+
+                moves.extend(encode_move(move) for move in game.moves)
+                move_offsets.append(len(moves))
+                game_no.append(number)
+                byte_end.append(offset + length)
+
+        arrays = {
+            "pgn_stamp": stamp,
+            "moves": np.frombuffer(moves, dtype=np.uint16) if moves else np.zeros(0, dtype=np.uint16),
+            "move_offsets": np.array(move_offsets, dtype=np.int64),
+            "game_no": np.array(game_no, dtype=np.int32),
+            "byte_end": np.array(byte_end, dtype=np.int64),
+        }
+        for tag in STORE_HEADERS:
+            arrays[f"codes_{tag}"] = np.array(codes[tag], dtype=np.int32)
+            arrays[f"values_{tag}"] = np.array(list(values[tag]), dtype=np.str_)
+        return arrays
+
+    def _save(self, arrays):
+        # np.savez appends .npz to names without it, so keep the suffix on the temp file
+        tmp_path = self.store_path + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.store_path)
+
+    def __len__(self):
+        return len(self.game_no)
+
+    def column(self, tag):
+        """Header values of every game, as a list of strings ("" when missing)."""
+        table = self.header_values[tag]
+        return [table[code] for code in self.header_codes[tag]]
+
+    def headers(self, i):
+        """Headers of the i-th stored game (0-based), leaving out missing ones."""
+        headers = {}
+        for tag in STORE_HEADERS:
+            value = self.header_values[tag][self.header_codes[tag][i]]
+            if value:
+                headers[tag] = value
+        return headers
+
+    def board(self, i):
+        fen = self.header_values["FEN"][self.header_codes["FEN"][i]]
+        return chess.Board(fen) if fen else chess.Board()
+
+    def game_moves(self, i, limit=None):
+        """Moves of the i-th stored game, only the first `limit` if given."""
+        start, end = self.move_offsets[i], self.move_offsets[i + 1]
+        if limit is not None:
+            end = min(end, start + limit)
+        codes = self.moves[start:end].tolist()
+        return [decode_move(code) for code in codes]
+
+    def iter_games(self, start_after=0):
+        """
+        Yield (game_no, headers, start_board, moves, byte_end) for every
+        stored game after the first `start_after` games of the PGN.
+        """
+        first = int(np.searchsorted(self.game_no, start_after, side="right"))
+        for i in range(first, len(self)):
+            yield int(self.game_no[i]), self.headers(i), self.board(i), self.game_moves(i), int(self.byte_end[i])
+
+
+# --------------------------------------------------
+# BUILD STORES
+# --------------------------------------------------
+
+if __name__ == "__main__":
+    for path in sys.argv[1:] or PGN_FILES:
+        if not os.path.exists(path):
+            print(f"PGN file not found: {path} (skipping)")
+            continue
+        store = GameStore(path)
+        state = "built" if store.rebuilt else "up to date"
+        print(f"{path}: {len(store)} games, {len(store.moves)} moves, store {state} ({store.store_path})")
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import sqlite3
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+
+STORE_PATH = "opening_stats.sqlite"
+
+# headers that identify a game across re-exports, together with its moves
+# (Event/Date/Round for OTB games, which have no Site link or UTC time)
+KEY_HEADERS = ["Event", "Site", "Link", "Date", "Round", "UTCDate", "UTCTime", "White", "Black"]
+
+# stored in meta, so counts keyed the old way (headers only) are never mixed in
+KEY_VERSION = "headers+moves"
+
+RESULTS = ("win", "loss", "draw")
+
+
+# --------------------------------------------------
+# HELPERS
+# --------------------------------------------------
+
+def game_key(headers, moves, fallback=""):
+    """
+    Stable identifier of a game from its headers and mainline moves, so two
+    games between the same players on the same day are told apart. Games
+    without any of the KEY_HEADERS get `fallback` mixed in (e.g. file and
+    game number) as well, so equal move lists are not merged into one.
+    """
+    values = [headers.get(tag, "") for tag in KEY_HEADERS]
+    if not any(values):
+        values.append(fallback)
+    h = hashlib.sha1()
+    for value in values:
+        h.update(value.encode("utf-8"))
+        h.update(b"\0")
+    h.update(" ".join(move.uci() for move in moves).encode("ascii"))
+    return h.hexdigest()[:16]
+
+
+# --------------------------------------------------
+# STORE
+# --------------------------------------------------
+
+class OpeningStore:
+    """
+    Running win/loss/draw counts per (color, opening, ECO), plus the keys of
+    every game already counted per color, in a small SQLite file.
+
+    add_game() counts a game only the first time its key is seen, so
+    re-running on a fresh export only adds the new games. Each PGN's size
+    and mtime are remembered as well, so a file that hasn't changed since
+    the last run is not scanned at all.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS games (
+                your_color TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (your_color, key)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS counts (
+                your_color TEXT NOT NULL,
+                opening_name TEXT NOT NULL,
+                eco TEXT NOT NULL,
+                win INTEGER NOT NULL DEFAULT 0,
+                loss INTEGER NOT NULL DEFAULT 0,
+                draw INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (your_color, opening_name, eco)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            """
+        )
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'key'").fetchone()
+        if row is None and self.conn.execute("SELECT 1 FROM games LIMIT 1").fetchone() is not None:
+            raise SystemExit(f"{path} was built with an older game key; pass --rebuild to start over")
+        self.conn.commit()
+        self.check_setting("key", KEY_VERSION)
+
+    def check_setting(self, name, value):
+        """
+        Remember a setting that changes the counts (e.g. how openings are
+        named) and refuse to mix in games counted under a different one.
+        """
+        row = self.conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            self.conn.execute("INSERT INTO meta (name, value) VALUES (?, ?)", (name, value))
+            self.conn.commit()
+        elif row[0] != value:
+            raise SystemExit(
+                f"{self.path} was built with {name}={row[0]}, not {value}; "
+                f"pass --rebuild to start over"
+            )
+
+    def file_unchanged(self, pgn_path):
+        st = os.stat(pgn_path)
+        row = self.conn.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (str(pgn_path),)).fetchone()
+        return row == (st.st_size, st.st_mtime_ns)
+
+    def mark_file(self, pgn_path):
+        st = os.stat(pgn_path)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns) VALUES (?, ?, ?)",
+            (str(pgn_path), st.st_size, st.st_mtime_ns),
+        )
+
+    def add_game(self, key, your_color, opening_name, eco, result):
+        """Count one game unless its key was counted for this color before. Returns True if it was new."""
+        if result not in RESULTS:
+            return False
+        cursor = self.conn.execute("INSERT OR IGNORE INTO games (your_color, key) VALUES (?, ?)", (your_color, key))
+        if cursor.rowcount == 0:
+            return False
+        self.conn.execute(
+            f"""
+            INSERT INTO counts (your_color, opening_name, eco, {result}) VALUES (?, ?, ?, 1)
+            ON CONFLICT (your_color, opening_name, eco) DO UPDATE SET {result} = {result} + 1
+            """,
+            (your_color, opening_name, eco),
+        )
+        return True
+
+    def counts(self):
+        """(your_color, opening_name, eco, win, loss, draw) rows."""
+        return self.conn.execute(
+            "SELECT your_color, opening_name, eco, win, loss, draw FROM counts"
+        ).fetchall()
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -1,6 +1,13 @@
-import re
+import argparse
+import os
+
 import pandas as pd
 
+from EcoClassifier import ECO_DIR, EcoClassifier
+from GameStore import GameStore
+from OpeningStore import STORE_PATH, OpeningStore, game_key
+from Players import PLAYERS_DIR, discover_players, player_dir
+
 # --------------------------------------------------
 # CONFIG
 # --------------------------------------------------
@@ -12,29 +19,14 @@ PGN_FILES = [
 
 OUTPUT_CSV = "opening_stats_by_color.csv"
 
+# --players: color_file label of Players.py -> your_color
+YOUR_COLOR = {"white_file": "White", "black_file": "Black"}
+
 
 # --------------------------------------------------
 # HELPERS
 # --------------------------------------------------
 
-def parse_pgn_headers(pgn_text: str):
-    """
-    Very simple PGN header parser: returns a dict of tag -> value.
-    Assumes headers appear as [Tag \"Value\"] lines at the top.
-    """
-    headers = {}
-    for line in pgn_text.splitlines():
-        line = line.strip()
-        if not line.startswith("["):
-            # headers finished
-            break
-        m = re.match(r'\[(\w+)\s+"(.*)"\]', line)
-        if m:
-            tag, val = m.group(1), m.group(2)
-            headers[tag] = val
-    return headers
-
-
 def extract_opening_name(eco_url: str) -> str:
     """
     From ECOUrl like:
@@ -68,70 +60,137 @@ def result_from_perspective(result_tag: str, you_are: str) -> str:
         return "other"
 
 
-# --------------------------------------------------
-# MAIN EXTRACTION
-# --------------------------------------------------
+def iter_opening_headers(path: str):
+    """
+    Yield (game_no, headers, moves, opening_name, eco) for every game in
+    path, with the opening taken from the ECOUrl/ECO headers. The moves are
+    only needed for the game key, so they come from the parsed-game store,
+    which is built if needed.
+    """
+    store = GameStore(path)
+    for i in range(len(store)):
+        headers = store.headers(i)
+        yield (int(store.game_no[i]), headers, store.game_moves(i),
+               extract_opening_name(headers.get("ECOUrl", "")), headers.get("ECO", ""))
 
-records = []
 
-for path, your_color in PGN_FILES:
-    try:
-        with open(path, encoding="utf-8") as f:
-            content = f.read()
-    except FileNotFoundError:
-        print(f"PGN file not found: {path} (skipping)")
-        continue
-
-    # Split games by blank line between games; robust split uses '\n\n[' pattern
-    # but we handle edge cases by using regex.
-    games_raw = re.split(r'\n\n(?=\[Event )', content.strip())
-    for game_txt in games_raw:
-        if not game_txt.strip():
+def iter_classified_games(path: str, classifier: EcoClassifier):
+    """
+    Yield (game_no, headers, moves, opening_name, eco) for every game in
+    path, with the opening found by walking the game's first moves through
+    the ECO position table. Works for any PGN, not just chess.com exports.
+    Moves come from the parsed-game store, which is built if needed.
+    """
+    store = GameStore(path)
+    for i in range(len(store)):
+        moves = store.game_moves(i)
+        eco, opening_name = classifier.classify(store.board(i), moves[:classifier.max_plies])
+        yield int(store.game_no[i]), store.headers(i), moves, opening_name, eco
+
+
+def count_new_games(store, pgn_files, classifier=None):
+    """Add the games of pgn_files [(path, your_color), ...] that store hasn't counted yet."""
+    for path, your_color in pgn_files:
+        if not os.path.exists(path):
+            print(f"PGN file not found: {path} (skipping)")
+            continue
+        if store.file_unchanged(path):
+            print(f"{path} unchanged since the last run (skipping)")
             continue
 
-        headers = parse_pgn_headers(game_txt)
-        eco = headers.get("ECO", "")
-        eco_url = headers.get("ECOUrl", "")
-        result_tag = headers.get("Result", "")
+        new_games = 0
+        if classifier is not None:
+            games = iter_classified_games(path, classifier)
+        else:
+            games = iter_opening_headers(path)
+
+        for game_no, headers, moves, opening_name, eco in games:
+            perspective_result = result_from_perspective(headers.get("Result", ""), your_color)
+            key = game_key(headers, moves, fallback=f"{path}:{game_no}")
+            new_games += store.add_game(key, your_color, opening_name, eco, perspective_result)
+
+        store.mark_file(path)
+        store.commit()
+        print(f"{path}: {new_games} new games counted")
+
+
+def opening_stats_from_store(store):
+    """Win/loss/draw, total and win rate per (your_color, opening_name, eco) from the stored counts."""
+    group = (
+        pd.DataFrame(store.counts(), columns=["your_color", "opening_name", "eco", "win", "loss", "draw"])
+        .set_index(["your_color", "opening_name", "eco"])
+        .sort_index()
+        [["draw", "loss", "win"]]
+    )
+
+    group["total"] = group[["win", "loss", "draw"]].sum(axis=1)
+    group["win_rate"] = group["win"] / group["total"].replace(0, pd.NA)
 
-        opening_name = extract_opening_name(eco_url)
-        perspective_result = result_from_perspective(result_tag, your_color)
+    return group.reset_index()
 
-        records.append({
-            "file": path,
-            "your_color": your_color,
-            "eco": eco,
-            "opening_name": opening_name,
-            "raw_result": result_tag,
-            "perspective_result": perspective_result,
-        })
 
-# Convert to DataFrame
-df = pd.DataFrame(records)
+def open_store(store_path, rebuild, classify):
+    if rebuild and os.path.exists(store_path):
+        os.remove(store_path)
+    store = OpeningStore(store_path)
+    store.check_setting("classify", classify)
+    return store
 
-# Filter valid results
-valid = df[df["perspective_result"].isin(["win", "loss", "draw"])].copy()
 
 # --------------------------------------------------
-# STATS BY OPENING + COLOR
+# MAIN EXTRACTION
 # --------------------------------------------------
 
-group = (
-    valid
-    .groupby(["your_color", "opening_name", "eco", "perspective_result"])
-    .size()
-    .unstack(fill_value=0)
-)
-
-# Ensure columns exist
-for col in ["win", "loss", "draw"]:
-    if col not in group.columns:
-        group[col] = 0
+parser = argparse.ArgumentParser(description="Win/loss/draw statistics per opening and color.")
+parser.add_argument("--store", default=STORE_PATH,
+                    help=f"SQLite file holding the running counts (default: {STORE_PATH})")
+parser.add_argument("--rebuild", action="store_true",
+                    help="forget every counted game and count all games again")
+parser.add_argument("--classify", choices=["ecourl", "moves"], default="ecourl",
+                    help="name openings from the chess.com ECOUrl header (default) or from the moves, "
+                         "using the ECO database in --eco-dir")
+parser.add_argument("--eco-dir", default=ECO_DIR,
+                    help=f"directory with the lichess chess-openings *.tsv files (default: {ECO_DIR})")
+parser.add_argument("--players", metavar="DIR_OR_MANIFEST",
+                    help="count every player found there (see Scheduler.py) instead of PGN_FILES, "
+                         f"with each player's store and CSV in {PLAYERS_DIR}/<player>/")
+parser.add_argument("--out-dir", default=PLAYERS_DIR,
+                    help=f"with --players: where the per-player folders go (default: {PLAYERS_DIR})")
+args = parser.parse_args()
+
+classifier = None
+if args.classify == "moves":
+    try:
+        classifier = EcoClassifier(args.eco_dir)
+    except FileNotFoundError as e:
+        raise SystemExit(f"{e}; see the README for where to get the ECO database")
+
+if args.players:
+    # one store and one CSV per player, in the same folders Scheduler.py writes to
+    for player, pgn_files in discover_players(args.players).items():
+        out_dir = player_dir(player, args.out_dir)
+        os.makedirs(out_dir, exist_ok=True)
+        store = open_store(os.path.join(out_dir, STORE_PATH), args.rebuild, args.classify)
+        count_new_games(store, [(path, YOUR_COLOR[color_file]) for path, color_file in pgn_files], classifier)
+        opening_stats = opening_stats_from_store(store)
+        store.close()
+
+        output_csv = os.path.join(out_dir, OUTPUT_CSV)
+        opening_stats.to_csv(output_csv, index=False)
+        print(f"{player}: {int(opening_stats['total'].sum())} games, saved to {output_csv}\n")
+    raise SystemExit(0)
+
+# counts are kept between runs; each game is only counted the first time
+# its key is seen, so a new export only costs the games that are new
+store = open_store(args.store, args.rebuild, args.classify)
+count_new_games(store, PGN_FILES, classifier)
 
-group["total"] = group[["win", "loss", "draw"]].sum(axis=1)
-group["win_rate"] = group["win"] / group["total"].replace(0, pd.NA)
+# --------------------------------------------------
+# STATS BY OPENING + COLOR
+# --------------------------------------------------
 
-opening_stats = group.reset_index()
+opening_stats = opening_stats_from_store(store)
+store.close()
 
 # Save to CSV
 opening_stats.to_csv(OUTPUT_CSV, index=False)
@@ -0,0 +1,165 @@
+import io
+import json
+import mmap
+import os
+import re
+import sys
+
+import chess.pgn
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+
+INDEX_SUFFIX = ".index.json"  # sidecar written next to each PGN
+
+# headers copied into the index, enough to identify a game and its result
+INDEX_HEADERS = [
+    "Site", "Link", "UTCDate", "UTCTime", "White", "Black", "Result", "ECO", "ECOUrl",
+]
+
+PGN_FILES = ["MAF13-white.pgn", "MAF13-black.pgn"]
+
+# one [Tag "Value"] line; the value may contain escaped quotes
+TAG_LINE = re.compile(rb'^[ \t]*\[([A-Za-z0-9_]+)[ \t]+"((?:[^"\\\r\n]|\\.)*)"[ \t]*\][ \t]*\r?$', re.MULTILINE)
+NON_SPACE = re.compile(rb"\S")
+
+
+# --------------------------------------------------
+# HELPERS
+# --------------------------------------------------
+
+def index_path_for(pgn_path):
+    return str(pgn_path) + INDEX_SUFFIX
+
+
+def _pgn_stamp(pgn_path):
+    st = os.stat(pgn_path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _unescape(value):
+    return value.decode("utf-8", errors="replace").replace('\\"', '"').replace("\\\\", "\\")
+
+
+def iter_game_headers(pgn_path, tags=INDEX_HEADERS):
+    """
+    Stream (offset, headers) for every game in pgn_path, headers restricted
+    to `tags`, without parsing or decoding any movetext.
+
+    The file is memory-mapped and searched for tag lines; a tag line starts
+    a new game when it is the first one in the file or when movetext came
+    between it and the previous tag line. Only the current game's headers
+    are held in memory.
+    """
+    if os.path.getsize(pgn_path) == 0:
+        return
+
+    tags = set(tags)
+    with open(pgn_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        offset = None
+        headers = {}
+        previous_end = None
+        for match in TAG_LINE.finditer(mm):
+            start = match.start()
+            if previous_end is None or NON_SPACE.search(mm, previous_end, start):
+                if offset is not None:
+                    yield offset, headers
+                offset = start
+                headers = {}
+            tag = match.group(1).decode("ascii")
+            if tag in tags:
+                headers[tag] = _unescape(match.group(2))
+            previous_end = match.end()
+        if offset is not None:
+            yield offset, headers
+
+
+def scan_games(pgn_path):
+    """Return [offset, length, headers] for every game in pgn_path (see iter_game_headers)."""
+    games = [[offset, 0, headers] for offset, headers in iter_game_headers(pgn_path)]
+    size = os.path.getsize(pgn_path)
+    for i, entry in enumerate(games):
+        end = games[i + 1][0] if i + 1 < len(games) else size
+        entry[1] = end - entry[0]
+    return games
+
+
+# --------------------------------------------------
+# INDEX
+# --------------------------------------------------
+
+class PgnIndex:
+    """
+    Byte-offset index of a PGN file, stored as a JSON sidecar next to it.
+
+    Games are numbered from 1 in file order, like Clean.py's game_id. The
+    sidecar records the PGN's size and mtime and is rebuilt when either
+    changes, so it never points into a stale file.
+    """
+
+    def __init__(self, pgn_path, index_path=None, rebuild=False):
+        self.pgn_path = str(pgn_path)
+        self.index_path = index_path or index_path_for(pgn_path)
+        self.games = None
+
+        stamp = _pgn_stamp(self.pgn_path)
+        if not rebuild and os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("pgn") == stamp:
+                self.games = saved["games"]
+
+        self.rebuilt = self.games is None
+        if self.rebuilt:
+            self.games = scan_games(self.pgn_path)
+            self._save(stamp)
+
+    def _save(self, stamp):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"pgn": stamp, "games": self.games}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def __len__(self):
+        return len(self.games)
+
+    def offset(self, game_no):
+        return self.games[game_no - 1][0]
+
+    def headers(self, game_no):
+        return self.games[game_no - 1][2]
+
+    def read_text(self, game_no):
+        """Raw PGN text of one game, read straight from its offset."""
+        offset, length, _headers = self.games[game_no - 1]
+        with open(self.pgn_path, "rb") as f:
+            f.seek(offset)
+            return f.read(length).decode("utf-8")
+
+    def read_game(self, game_no, Visitor=chess.pgn.GameBuilder):
+        return chess.pgn.read_game(io.StringIO(self.read_text(game_no)), Visitor=Visitor)
+
+    def open_at(self, game_no):
+        """
+        Text stream of the PGN positioned at the start of game_no, for
+        parsing a shard of games with chess.pgn.read_game. Past the last
+        game the stream is at end of file.
+        """
+        f = open(self.pgn_path, "rb")
+        f.seek(self.offset(game_no) if game_no <= len(self) else os.path.getsize(self.pgn_path))
+        return io.TextIOWrapper(f, encoding="utf-8")
+
+
+# --------------------------------------------------
+# BUILD INDEXES
+# --------------------------------------------------
+
+if __name__ == "__main__":
+    for path in sys.argv[1:] or PGN_FILES:
+        if not os.path.exists(path):
+            print(f"PGN file not found: {path} (skipping)")
+            continue
+        index = PgnIndex(path)
+        state = "built" if index.rebuilt else "up to date"
+        print(f"{path}: {len(index)} games, index {state} ({index.index_path})")
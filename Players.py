@@ -0,0 +1,83 @@
+import csv
+import glob
+import os
+import re
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+
+PLAYERS_DIR = "players"  # per-player outputs go to players/<name>/
+
+# <name>-white.pgn / <name>-black.pgn, like MAF13-white.pgn / MAF13-black.pgn
+PGN_NAME = re.compile(r"^(?P<player>.+)-(?P<color>white|black)\.pgn$", re.IGNORECASE)
+
+COLOR_FILES = {"white": "white_file", "black": "black_file"}
+
+
+# --------------------------------------------------
+# HELPERS
+# --------------------------------------------------
+
+def _color_file(color):
+    color = color.strip().lower()
+    if color in COLOR_FILES.values():
+        return color
+    if color in COLOR_FILES:
+        return COLOR_FILES[color]
+    raise ValueError(f"unknown color {color!r} (expected white or black)")
+
+
+def players_from_dir(directory):
+    """{player: [(pgn_path, color_file), ...]} for every <name>-white/black.pgn in directory."""
+    players = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.pgn"))):
+        match = PGN_NAME.match(os.path.basename(path))
+        if match is None:
+            print(f"Not a <player>-white.pgn / <player>-black.pgn file: {path} (skipping)")
+            continue
+        players.setdefault(match["player"], []).append((path, _color_file(match["color"])))
+    return players
+
+
+def players_from_manifest(manifest_path):
+    """
+    {player: [(pgn_path, color_file), ...]} from a CSV with player, pgn and
+    color columns. Relative PGN paths are taken from the manifest's folder.
+    """
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    players = {}
+    with open(manifest_path, newline="", encoding="utf-8") as f:
+        for line_no, row in enumerate(csv.DictReader(f), start=2):
+            try:
+                color_file = _color_file(row["color"])
+            except ValueError as e:
+                raise SystemExit(f"{manifest_path} line {line_no}: {e}")
+            path = os.path.join(base, row["pgn"])
+            players.setdefault(row["player"].strip(), []).append((path, color_file))
+    return players
+
+
+def discover_players(source):
+    """
+    Players and their PGN files from a directory of <player>-white.pgn /
+    <player>-black.pgn files or from a manifest CSV (see players_from_manifest).
+    White files come before black files, as in Clean.PGN_FILES.
+    """
+    if os.path.isdir(source):
+        players = players_from_dir(source)
+    elif os.path.exists(source):
+        players = players_from_manifest(source)
+    else:
+        raise SystemExit(f"no such player directory or manifest: {source}")
+
+    order = list(COLOR_FILES.values())
+    return {
+        player: sorted(files, key=lambda item: order.index(item[1]))
+        for player, files in sorted(players.items())
+    }
+
+
+def player_dir(player, root=PLAYERS_DIR):
+    """Output folder of one player, with characters that can't be in a file name replaced."""
+    return os.path.join(root, re.sub(r"[^\w.@+-]", "_", player))
@@ -0,0 +1,130 @@
+import argparse
+import time
+
+import pandas as pd
+
+from Analyticswb import ERROR_TYPES, IMB_PLAYER_CSV, render_prescription
+from TableIO import read_table
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+
+# errors_imb_with_result_and_phase_player_only.csv of many players, with a player column
+INPUT_CSV = "errors_imb_with_result_and_phase_by_player.csv"
+WINRATES_CSV = "phase_error_winrates_by_player.csv"
+PRESCRIPTIONS_CSV = "prescriptions_by_player.csv"
+
+COLUMNS = ["player", "color_file", "phase", "error_type", "outcome"]
+COLOR_LABELS = {"white_file": "White", "black_file": "Black"}
+OUTCOMES = ["win", "loss", "draw"]
+
+
+# --------------------------------------------------
+# HELPERS
+# --------------------------------------------------
+
+def player_phase_error_winrates(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Analyticswb.compute_phase_error_winrates for every player and color at
+    once: one groupby over categorical (player, color_file, phase,
+    error_type, outcome) keys, then one unstack of the outcomes.
+    """
+    # filtering categoricals only compares their few categories
+    keys = df[COLUMNS].astype({col: "category" for col in COLUMNS})
+    keys = keys[keys["outcome"].isin(OUTCOMES) & keys["error_type"].isin(ERROR_TYPES)]
+
+    group = keys.groupby(COLUMNS, observed=True).size().unstack("outcome", fill_value=0)
+    for col in OUTCOMES:
+        if col not in group.columns:
+            group[col] = 0
+    group = group[["draw", "loss", "win"]]
+    group.columns = list(group.columns)
+
+    group["total"] = group[["win", "loss", "draw"]].sum(axis=1)
+    group["win_rate"] = group["win"] / group["total"].replace(0, pd.NA)
+    return group.reset_index().astype({col: object for col in COLUMNS[:-1]})
+
+
+def player_phase_stats(winrates: pd.DataFrame) -> pd.DataFrame:
+    """
+    Wins and games per (player, color_file, phase), summed over error types,
+    ordered by win rate within each player and color (weakest phase first,
+    ties in phase order, as generate_prescription sorts them). White comes
+    before Black for each player.
+    """
+    stats = winrates.groupby(["player", "color_file", "phase"], sort=True)[["win", "total"]].sum().reset_index()
+    stats["win_rate"] = (stats["win"] / stats["total"].where(stats["total"] > 0)).fillna(0.0)
+    # White before Black, like Analyticswb.py
+    color_order = stats["color_file"].map({color: i for i, color in enumerate(COLOR_LABELS)})
+    order = stats.assign(color_order=color_order).sort_values(["player", "color_order", "win_rate"], kind="mergesort").index
+    return stats.loc[order].reset_index(drop=True)
+
+
+def render_all(stats: pd.DataFrame) -> pd.DataFrame:
+    """One row per player and color: weakest and strongest phase and the prescription text."""
+    rows = []
+    current, phase_stats = None, {}
+    for player, color_file, phase, wins, total, win_rate in stats.itertuples(index=False):
+        if (player, color_file) != current:
+            if current is not None:
+                rows.append(_prescription_row(current, phase_stats))
+            current, phase_stats = (player, color_file), {}
+        phase_stats[phase] = {"wins": wins, "total": total, "win_rate": win_rate}
+    if current is not None:
+        rows.append(_prescription_row(current, phase_stats))
+    return pd.DataFrame(rows, columns=["player", "your_color", "weakest_phase", "strongest_phase", "prescription"])
+
+
+def _prescription_row(current, phase_stats):
+    player, color_file = current
+    label = COLOR_LABELS.get(color_file, color_file)
+    phases = list(phase_stats)  # already weakest first
+    return player, label, phases[0], phases[-1], render_prescription(phase_stats, label)
+
+
+# --------------------------------------------------
+# RUN
+# --------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Win rates and training prescriptions for many players in one pass.")
+    parser.add_argument("--input", default=INPUT_CSV,
+                        help=f"I/M/B errors with result and phase, plus a player column (default: {INPUT_CSV})")
+    parser.add_argument("--player", metavar="NAME",
+                        help=f"name to use when the input has no player column, e.g. for {IMB_PLAYER_CSV}")
+    parser.add_argument("--show", metavar="NAME", action="append", default=[],
+                        help="also print this player's prescriptions (repeatable)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    columns = COLUMNS if args.player is None else COLUMNS[1:]
+    df = read_table(args.input, columns=columns)
+    if args.player is not None:
+        df["player"] = args.player
+
+    winrates = player_phase_error_winrates(df)
+    prescriptions = render_all(player_phase_stats(winrates))
+
+    winrates.to_csv(WINRATES_CSV, index=False)
+    prescriptions.to_csv(PRESCRIPTIONS_CSV, index=False)
+    elapsed = time.perf_counter() - start
+
+    players = prescriptions["player"].nunique()
+    print(f"{len(df)} error rows, {players} players, {len(prescriptions)} prescriptions in {elapsed:.1f} s")
+    print("\nWeakest phase (players × color):")
+    print(prescriptions.groupby(["your_color", "weakest_phase"]).size().unstack(fill_value=0))
+    print(f"\nSaved win rates to: {WINRATES_CSV}")
+    print(f"Saved prescriptions to: {PRESCRIPTIONS_CSV}")
+
+    for name in args.show:
+        found = prescriptions[prescriptions["player"].astype(str) == name]
+        if found.empty:
+            print(f"\nNo data for player {name}")
+        for text in found["prescription"]:
+            print()
+            print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import argparse
+import heapq
+
+import numpy as np
+import pandas as pd
+
+from Calculation import ERROR_TYPES, MEMORY_LIMIT_MB, OUTPUT_ERRORS_ONLY_CSV, PLAYER_SIDE, peak_memory_mb, read_chunks
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+
+INPUT_CSV = OUTPUT_ERRORS_ONLY_CSV  # games_with_errors_only_imb.csv (games_with_errors.csv works too)
+OUTPUT_CSV = "error_move_repeats_by_move_number_ranked.csv"
+
+COLUMNS = ["color_file", "side", "error_type", "move_number", "san"]
+SIDES = ["White", "Black"]
+
+# --top: counters kept per error type, as a multiple of K; more counters
+# make the counts of the top K exact on less skewed data
+TOP_CAPACITY_FACTOR = 20
+
+# a (side, error_type, move_number, san) key packed into one int:
+#   side (1 bit) | error type (2 bits) | move_number (16 bits) | SAN id (rest)
+MOVE_BITS = 16
+SAN_SHIFT = 3 + MOVE_BITS
+
+
+# --------------------------------------------------
+# HELPERS
+# --------------------------------------------------
+
+def pack_keys(chunk: pd.DataFrame, san_ids: dict) -> np.ndarray:
+    """
+    Packed key of every row of chunk. SAN strings get ids from san_ids,
+    which grows as new moves appear; that vocabulary is small (a few
+    thousand SANs), however many rows are read.
+    """
+    codes, uniques = pd.factorize(chunk["san"])
+    lookup = np.array([san_ids.setdefault(san, len(san_ids)) for san in uniques], dtype=np.int64)
+    side = (chunk["side"].to_numpy() == "Black").astype(np.int64)
+    error = pd.Categorical(chunk["error_type"], categories=ERROR_TYPES).codes.astype(np.int64)
+    move_number = chunk["move_number"].to_numpy().astype(np.int64)
+    return side | (error << 1) | (move_number << 3) | (lookup[codes] << SAN_SHIFT)
+
+
+def unpack_key(key: int, sans: list):
+    """Packed key -> (side, error_type, move_number, san)."""
+    return (
+        SIDES[key & 1],
+        ERROR_TYPES[(key >> 1) & 3],
+        (key >> 3) & ((1 << MOVE_BITS) - 1),
+        sans[key >> SAN_SHIFT],
+    )
+
+
+def iter_key_counts(input_csv: str, memory_limit_mb: float, san_ids: dict):
+    """
+    Stream input_csv (or its Parquet twin) and yield (keys, counts) arrays
+    per chunk for the player's own I/M/B moves: White moves of the white
+    file, Black moves of the black file.
+    """
+    for chunk in read_chunks(input_csv, memory_limit_mb, columns=COLUMNS):
+        chunk = chunk[chunk["error_type"].isin(ERROR_TYPES)]
+        chunk = chunk.astype({"color_file": object, "side": object, "error_type": object})
+        chunk = chunk[chunk["side"] == chunk["color_file"].map(PLAYER_SIDE)]
+        if len(chunk):
+            yield np.unique(pack_keys(chunk, san_ids), return_counts=True)
+
+
+class TopCounter:
+    """
+    Bounded-memory counts of the most frequent keys (the Space-Saving
+    algorithm). At most `capacity` keys are tracked. When a new key arrives
+    and the table is full, the key with the lowest count is dropped and the
+    new key inherits that count. Counts can therefore be overestimated, by
+    at most errors[key]. Every key whose true count exceeds the lowest
+    tracked count is guaranteed to be in the table.
+
+    A min-heap of (count, key) finds the lowest count. It is updated lazily:
+    entries whose count no longer matches the table are skipped.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.heap = []
+
+    def add(self, key, n):
+        if key in self.counts:
+            self.counts[key] += n
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = n
+            self.errors[key] = 0
+        else:
+            floor = self._pop_lowest()
+            self.counts[key] = floor + n
+            self.errors[key] = floor
+        heapq.heappush(self.heap, (self.counts[key], key))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(count, key) for key, count in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def _pop_lowest(self):
+        while True:
+            count, key = heapq.heappop(self.heap)
+            if self.counts.get(key) == count:
+                del self.counts[key]
+                del self.errors[key]
+                return count
+
+
+def count_repeats(input_csv: str, memory_limit_mb: float):
+    """Exact count of every key, in one dict from packed key to count. Returns (counts, sans)."""
+    san_ids = {}
+    counts = {}
+    for keys, chunk_counts in iter_key_counts(input_csv, memory_limit_mb, san_ids):
+        for key, n in zip(keys.tolist(), chunk_counts.tolist()):
+            counts[key] = counts.get(key, 0) + n
+    return counts, list(san_ids)
+
+
+def count_top_repeats(input_csv: str, memory_limit_mb: float, capacity: int):
+    """TopCounter per error type instead of the full dict. Returns ({error_type: TopCounter}, sans)."""
+    san_ids = {}
+    counters = [TopCounter(capacity) for _ in ERROR_TYPES]
+    for keys, chunk_counts in iter_key_counts(input_csv, memory_limit_mb, san_ids):
+        for key, n in zip(keys.tolist(), chunk_counts.tolist()):
+            counters[(key >> 1) & 3].add(key, n)
+    return dict(zip(ERROR_TYPES, counters)), list(san_ids)
+
+
+def ranked_table(counts: dict, sans: list, top: int = None) -> pd.DataFrame:
+    """
+    The ranked CSV: grouped by error type, most repeated first, ties by
+    side, move number and SAN. With `top`, only the first `top` rows of each
+    error type are kept.
+    """
+    rows = [unpack_key(key, sans) + (count,) for key, count in counts.items()]
+    df = pd.DataFrame(rows, columns=["side", "error_type", "move_number", "san", "count"])
+    df["move_san"] = df["move_number"].astype(str) + ". " + df["san"]
+    df = df.sort_values(
+        ["error_type", "count", "side", "move_number", "san"],
+        ascending=[True, False, True, True, True],
+        kind="mergesort",
+    )
+    if top is not None:
+        df = df.groupby("error_type", sort=False).head(top)
+    return df[["side", "error_type", "move_number", "san", "move_san", "count"]].reset_index(drop=True)
+
+
+# --------------------------------------------------
+# RUN
+# --------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank the player's most repeated errors by move number and SAN.")
+    parser.add_argument("--input", default=INPUT_CSV, help=f"error table to read (default: {INPUT_CSV})")
+    parser.add_argument("--output", default=OUTPUT_CSV, help=f"ranked CSV to write (default: {OUTPUT_CSV})")
+    parser.add_argument("--top", type=int, metavar="K",
+                        help="keep only the K most repeated errors per error type, in bounded memory")
+    parser.add_argument("--capacity", type=int, metavar="N",
+                        help=f"with --top: counters per error type (default: {TOP_CAPACITY_FACTOR} x K)")
+    parser.add_argument("--memory-limit", type=float, default=MEMORY_LIMIT_MB, metavar="MB",
+                        help=f"peak memory to aim for while streaming (default: {MEMORY_LIMIT_MB})")
+    args = parser.parse_args()
+    if args.capacity is not None and args.top is None:
+        parser.error("--capacity needs --top")
+
+    if args.top is None:
+        counts, sans = count_repeats(args.input, args.memory_limit)
+        ranked = ranked_table(counts, sans)
+        print(f"{len(counts)} distinct repeated errors")
+    else:
+        capacity = max(args.capacity or TOP_CAPACITY_FACTOR * args.top, args.top)
+        counters, sans = count_top_repeats(args.input, args.memory_limit, capacity)
+        counts = {}
+        for counter in counters.values():
+            counts.update(counter.counts)
+        ranked = ranked_table(counts, sans, top=args.top)
+
+        # a row is certainly in the top K when even its lowest possible
+        # count beats the (K+1)th tracked count of its error type
+        print(f"Top {args.top} per error type, {capacity} counters each")
+        for error_type, counter in counters.items():
+            top_counts = heapq.nlargest(args.top + 1, counter.counts.values())
+            cutoff = top_counts[args.top] if len(top_counts) > args.top else 0
+            keys = heapq.nlargest(args.top, counter.counts, key=counter.counts.get)
+            exact = sum(counter.errors[key] == 0 for key in keys)
+            certain = sum(counter.counts[key] - counter.errors[key] >= cutoff for key in keys)
+            print(f"  {error_type:10s}: {exact}/{len(keys)} counts exact, {certain}/{len(keys)} certainly in the top {args.top}")
+
+    ranked.to_csv(args.output, index=False)
+    print(f"Saved ranked errors to: {args.output}")
+    print(f"Peak memory: {peak_memory_mb():.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
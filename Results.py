@@ -0,0 +1,162 @@
+import argparse
+
+import pandas as pd
+
+from Calculation import ERROR_TYPES, MEMORY_LIMIT_MB, OUTPUT_ERRORS_ONLY_CSV, PLAYER_SIDE, assign_phases, read_chunks
+from Clean import PGN_FILES, game_key
+from GameStore import GameStore, store_is_fresh
+from PgnIndex import iter_game_headers
+from TableIO import csv_to_parquet, require_parquet
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+
+INPUT_CSV = OUTPUT_ERRORS_ONLY_CSV  # games_with_errors_only_imb.csv, written by Calculation.py
+OUTPUT_PLAYER_CSV = "errors_imb_with_result_and_phase_player_only.csv"
+WINRATES_CSV = "phase_error_winrates.csv"                         # moves of both sides
+WINRATES_PLAYER_CSV = "phase_error_winrates_player_only.csv"      # the player's moves only
+
+# PGN result -> outcome for the player of each color file
+OUTCOMES = {
+    "white_file": {"1-0": "win", "0-1": "loss", "1/2-1/2": "draw"},
+    "black_file": {"1-0": "loss", "0-1": "win", "1/2-1/2": "draw"},
+}
+
+
+# --------------------------------------------------
+# HELPERS
+# --------------------------------------------------
+
+def game_results(pgn_path: str, color_file: str, with_keys: bool = False) -> pd.DataFrame:
+    """
+    One row per game of pgn_path: color_file, game_id (position of the game
+    in the file, as Clean.py numbers them), result and the player's outcome.
+    Only the Result tag is needed, so it comes from the parsed-game store
+    when that is up to date and from the PGN's tag lines otherwise.
+
+    with_keys adds Clean.py's game_key, for output of Clean.py --incremental,
+    where game_id no longer matches the position in the file. The key hashes
+    the moves, so the store is built if needed.
+    """
+    if with_keys or store_is_fresh(pgn_path):
+        store = GameStore(pgn_path)
+        results = pd.DataFrame({"game_id": store.game_no, "result": store.column("Result")})
+        if with_keys:
+            results["game_key"] = [game_key(store.headers(i), store.game_moves(i)) for i in range(len(store))]
+    else:
+        tags = [headers.get("Result", "") for _offset, headers in iter_game_headers(pgn_path, ["Result"])]
+        results = pd.DataFrame({"game_id": range(1, len(tags) + 1), "result": tags})
+
+    results.insert(0, "color_file", color_file)
+    results["outcome"] = results["result"].map(OUTCOMES[color_file])
+    return results
+
+
+def outcome_counts(rows: pd.DataFrame) -> pd.Series:
+    """Rows with a known outcome, counted per (phase, error_type, outcome)."""
+    rows = rows.loc[rows["outcome"].notna(), ["phase", "error_type", "outcome"]]
+    return rows.astype(object).groupby(["phase", "error_type", "outcome"]).size()
+
+
+def phase_error_winrates(counts: pd.Series) -> pd.DataFrame:
+    """Same table as Analytics.compute_phase_error_winrates, from counts summed over chunks."""
+    group = counts.unstack(fill_value=0)
+    for col in ["win", "loss", "draw"]:
+        if col not in group.columns:
+            group[col] = 0
+    group = group[["draw", "loss", "win"]]
+    group.columns.name = None
+
+    group["total"] = group[["win", "loss", "draw"]].sum(axis=1)
+    group["win_rate"] = group["win"] / group["total"].replace(0, pd.NA)
+    return group.reset_index()
+
+
+def join_results(input_csv: str, output_csv: str, results: pd.DataFrame, on: list, memory_limit_mb: float):
+    """
+    Stream input_csv in chunks, hash-join the game results onto each chunk,
+    add phase and outcome, and append the player's own rows to output_csv.
+    Returns (counts over all rows, counts over the player's rows, rows without a result).
+    """
+    all_counts = player_counts = None
+    unmatched = 0
+
+    for i, chunk in enumerate(read_chunks(input_csv, memory_limit_mb)):
+        chunk = chunk[chunk["error_type"].isin(ERROR_TYPES)]
+        # read_chunks gives categoricals with per-chunk categories; join on plain values
+        chunk = chunk.astype({col: object for col in on + ["side", "error_type"]})
+        chunk = chunk.merge(results, on=on, how="left", sort=False)
+        chunk["phase"] = assign_phases(chunk["move_number"])
+        unmatched += int(chunk["result"].isna().sum())
+
+        player = chunk[chunk["side"] == chunk["color_file"].map(PLAYER_SIDE)]
+        player.to_csv(output_csv, mode="w" if i == 0 else "a", header=i == 0, index=False)
+
+        chunk_counts, chunk_player_counts = outcome_counts(chunk), outcome_counts(player)
+        all_counts = chunk_counts if all_counts is None else all_counts.add(chunk_counts, fill_value=0)
+        player_counts = chunk_player_counts if player_counts is None else player_counts.add(chunk_player_counts, fill_value=0)
+
+    return all_counts.astype(int), player_counts.astype(int), unmatched
+
+
+# --------------------------------------------------
+# RUN
+# --------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Join game results and phases onto the I/M/B errors.")
+    parser.add_argument("--parquet", action="store_true",
+                        help=f"also write {OUTPUT_PLAYER_CSV[:-4]}.parquet (needs pyarrow)")
+    parser.add_argument("--by-key", action="store_true",
+                        help="match games on game_key instead of game_id (for output of Clean.py --incremental)")
+    parser.add_argument("--memory-limit", type=float, default=MEMORY_LIMIT_MB, metavar="MB",
+                        help=f"peak memory to stay under while streaming (default: {MEMORY_LIMIT_MB})")
+    args = parser.parse_args()
+    if args.parquet:
+        require_parquet()
+
+    # --------------------------------------------------
+    # 1) ONE RESULT PER GAME, FROM EACH PGN
+    # --------------------------------------------------
+
+    on = ["color_file", "game_key"] if args.by_key else ["color_file", "game_id"]
+
+    frames = []
+    for pgn_path, color_file in PGN_FILES:
+        results = game_results(pgn_path, color_file, with_keys=args.by_key)
+        print(f"{pgn_path}: {len(results)} game results")
+        frames.append(results)
+    results = pd.concat(frames, ignore_index=True)
+    if args.by_key:
+        results = results.drop(columns=["game_id"])  # the rows keep their own game_id
+    results = results.drop_duplicates(subset=on)
+
+    # --------------------------------------------------
+    # 2) JOIN ONTO THE I/M/B ROWS (STREAMED)
+    # --------------------------------------------------
+
+    all_counts, player_counts, unmatched = join_results(INPUT_CSV, OUTPUT_PLAYER_CSV, results, on, args.memory_limit)
+    print(f"Saved player-only errors with result and phase to: {OUTPUT_PLAYER_CSV}")
+    if unmatched:
+        print(f"Warning: {unmatched} rows have no game result (joined on {' + '.join(on)})")
+    if args.parquet:
+        print(f"Saved Parquet copy to: {csv_to_parquet(OUTPUT_PLAYER_CSV)}")
+
+    # --------------------------------------------------
+    # 3) WIN RATES BY PHASE AND ERROR TYPE
+    # --------------------------------------------------
+
+    phase_error_winrates(all_counts).to_csv(WINRATES_CSV, index=False)
+    player_winrates = phase_error_winrates(player_counts)
+    player_winrates.to_csv(WINRATES_PLAYER_CSV, index=False)
+
+    print("\n=== PHASE × ERROR TYPE WIN RATES (PLAYER ONLY) ===")
+    print(player_winrates)
+    print("\nSaved win rates to:")
+    print(f"  {WINRATES_CSV}")
+    print(f"  {WINRATES_PLAYER_CSV}")
+
+
+if __name__ == "__main__":
+    main()
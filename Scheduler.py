@@ -0,0 +1,363 @@
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+import queue
+import time
+from collections import Counter
+from functools import partial
+
+import numpy as np
+
+from Clean import (CHECKPOINT_PATH, DEPTH_SINGLE, ENGINE_HASH, MAX_IN_FLIGHT_PER_WORKER, OUTPUT_CSV, SYZYGY_PATH,
+                   CheckpointedOutput, _analyse_game_task, _init_worker, iter_new_games, print_run_summary,
+                   write_game)
+from EvalCache import CACHE_MAX_ENTRIES, CACHE_PATH
+from GameStore import GameStore
+from Players import PLAYERS_DIR, discover_players, player_dir
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+
+MAX_ACTIVE_PLAYERS = 32   # players with open outputs at a time; the rest wait their turn
+STATUS_EVERY = 30         # seconds between per-player progress reports
+DONE_FILE = "games_with_errors.done.json"  # left in a player's folder once all of its games are written
+
+
+# --------------------------------------------------
+# HELPERS
+# --------------------------------------------------
+
+def format_duration(seconds):
+    if seconds is None:
+        return "--"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+
+def done_state(pgn_files, checkpoint_options):
+    """What a finished player's DONE_FILE records: the options and each PGN's size and mtime."""
+    files = {}
+    for path, _color in pgn_files:
+        if os.path.exists(path):
+            st = os.stat(path)
+            files[path] = [st.st_size, st.st_mtime_ns]
+    return {"options": checkpoint_options, "files": files}
+
+
+def player_is_done(out_dir, state):
+    """Whether the player was finished before with the same options and unchanged PGNs."""
+    path = os.path.join(out_dir, DONE_FILE)
+    if not os.path.exists(path):
+        return False
+    with open(path, encoding="utf-8") as f:
+        return json.load(f) == state
+
+
+class PlayerJob:
+    """
+    One player's PGN files, analysed game by game into the player's own
+    folder (games_with_errors.csv plus its checkpoint, as Clean.py writes
+    them). Games can finish in any order on the pool; they are written back
+    in game order, so a stopped run resumes like Clean.py does.
+    """
+
+    def __init__(self, name, pgn_files, out_dir, checkpoint_options, resume):
+        self.name = name
+        self.out_dir = out_dir
+        self.done_state = done_state(pgn_files, checkpoint_options)
+        self.pgn_files = [(path, color) for path, color in pgn_files if os.path.exists(path)]
+        for path, _color in pgn_files:
+            if not os.path.exists(path):
+                print(f"{name}: PGN file not found: {path} (skipping)")
+
+        os.makedirs(out_dir, exist_ok=True)
+        self.output = CheckpointedOutput(
+            os.path.join(out_dir, OUTPUT_CSV), os.path.join(out_dir, CHECKPOINT_PATH),
+            options=checkpoint_options, resume=resume,
+        )
+
+        # games still to do, for the ETA (the store is built here if needed)
+        self.games_total = 0
+        for path, _color in self.pgn_files:
+            store = GameStore(path)
+            self.games_total += int(np.sum(store.game_no > self.output.games_done(path)))
+
+        self.tasks = self._iter_tasks()
+        self.submitted = 0     # tasks handed to the pool
+        self.written = 0       # results written, always a prefix of the submitted tasks
+        self.pending = {}      # seq -> finished game waiting for an earlier one
+        self.work = 0          # plies submitted, what fair queueing balances
+        self.offset = 0        # set by FairQueue when the player is admitted
+        self.games_done = 0
+        self.started = time.monotonic()
+        self._next = next(self.tasks, None)
+        self.exhausted = self._next is None
+
+    def _iter_tasks(self):
+        for pgn_path, color_label in self.pgn_files:
+            for args, meta in iter_new_games(pgn_path, color_label, self.output.games_done(pgn_path)):
+                yield pgn_path, args, meta
+
+    def next_task(self):
+        """(seq, pgn_path, args, meta) of the next game, or None when every game was handed out."""
+        task = self._next
+        if task is None:
+            self.exhausted = True
+            return None
+        # look one game ahead, so the job knows it is done as soon as its last game is written
+        self._next = next(self.tasks, None)
+        self.exhausted = self._next is None
+
+        seq = self.submitted
+        self.submitted += 1
+        self.work += len(task[1][3])
+        return (seq,) + task
+
+    def add_result(self, seq, pgn_path, meta, rows):
+        """Keep a finished game and write out every game that is now next in order. Returns games written."""
+        self.pending[seq] = (pgn_path, meta, rows)
+        written = 0
+        while self.written in self.pending:
+            pgn_path, meta, rows = self.pending.pop(self.written)
+            write_game(self.output, pgn_path, meta, rows)
+            self.written += 1
+            self.games_done += 1
+            written += 1
+        return written
+
+    @property
+    def finished(self):
+        return self.exhausted and self.written == self.submitted
+
+    def close(self):
+        """Finish the output (removing its checkpoint) and mark the player as done."""
+        self.output.close(completed=True)
+        tmp_path = os.path.join(self.out_dir, DONE_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.done_state, f)
+        os.replace(tmp_path, os.path.join(self.out_dir, DONE_FILE))
+
+    def eta(self):
+        """Seconds left at this player's rate so far, or None before the first game."""
+        if not self.games_done:
+            return None
+        rate = self.games_done / (time.monotonic() - self.started)
+        return max(self.games_total - self.games_done, 0) / rate
+
+    def status(self):
+        percent = self.games_done / self.games_total * 100 if self.games_total else 100.0
+        return (
+            f"  {self.name:20s} {self.games_done:6d}/{self.games_total:<6d} games "
+            f"{percent:5.1f}%  ETA {format_duration(self.eta())}"
+        )
+
+
+class FairQueue:
+    """
+    Hands out games from up to max_active players at a time. The next game
+    always comes from the active player with the least work (plies) handed
+    out so far, so a player with thousands of games can't starve one with
+    ten. A player admitted later starts level with the least-served active
+    player instead of at zero, so it doesn't jump the queue either.
+    """
+
+    def __init__(self, players, make_job, max_active):
+        self.waiting = list(players.items())
+        self.make_job = make_job
+        self.max_active = max_active
+        self.active = []
+        self.heap = []        # (work + offset, admission order, job)
+        self.admitted = 0
+
+    def admit(self):
+        """Open outputs for waiting players while there is room. Returns the new jobs."""
+        new_jobs = []
+        while self.waiting and len(self.active) < self.max_active:
+            name, pgn_files = self.waiting.pop(0)
+            job = self.make_job(name, pgn_files)
+            job.offset = self.heap[0][0] if self.heap else 0
+            self.active.append(job)
+            new_jobs.append(job)
+            if not job.exhausted:
+                heapq.heappush(self.heap, (job.offset + job.work, self.admitted, job))
+            self.admitted += 1
+        return new_jobs
+
+    def next_task(self):
+        """(job, seq, pgn_path, args, meta), or None when no active player has a game left to hand out."""
+        while self.heap:
+            _key, order, job = heapq.heappop(self.heap)
+            task = job.next_task()
+            if task is None:
+                continue
+            if not job.exhausted:
+                heapq.heappush(self.heap, (job.offset + job.work, order, job))
+            return (job,) + task
+        return None
+
+    def retire(self, job):
+        self.active.remove(job)
+
+
+# --------------------------------------------------
+# RUN
+# --------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Analyse the PGNs of many players on one shared engine pool, one output folder per player.")
+    parser.add_argument("source",
+                        help="directory of <player>-white.pgn / <player>-black.pgn files, "
+                             "or a CSV manifest with player, pgn and color columns")
+    parser.add_argument("--out-dir", default=PLAYERS_DIR,
+                        help=f"where the per-player folders go (default: {PLAYERS_DIR})")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of Stockfish processes shared by all players (default: one per core)")
+    parser.add_argument("--threads", type=int, default=1, help="Threads per engine (default: 1)")
+    parser.add_argument("--hash", type=int, default=None,
+                        help="Hash MB per engine (default: ENGINE_HASH split across workers)")
+    parser.add_argument("--depth", type=int, default=DEPTH_SINGLE,
+                        help=f"search depth (default: {DEPTH_SINGLE})")
+    parser.add_argument("--compat", action="store_true",
+                        help="search twice per ply to reproduce the original numbers (see Clean.py)")
+    parser.add_argument("--player-only", action="store_true",
+                        help="only analyse the player's own moves")
+    parser.add_argument("--syzygy", default=SYZYGY_PATH, metavar="DIR",
+                        help="Syzygy tablebase directory (see Clean.py)")
+    parser.add_argument("--cache", default=CACHE_PATH,
+                        help=f"SQLite file for cached evaluations, shared by all players (default: {CACHE_PATH})")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always ask the engine, never read or write the eval cache")
+    parser.add_argument("--max-active", type=int, default=MAX_ACTIVE_PLAYERS, metavar="N",
+                        help=f"players analysed side by side (default: {MAX_ACTIVE_PLAYERS})")
+    parser.add_argument("--status-every", type=float, default=STATUS_EVERY, metavar="SECONDS",
+                        help=f"seconds between progress reports (default: {STATUS_EVERY})")
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore the players' checkpoints and analyse every game from scratch")
+    args = parser.parse_args()
+
+    if args.workers < 1 or args.max_active < 1:
+        parser.error("--workers and --max-active must be at least 1")
+
+    players = discover_players(args.source)
+    if not players:
+        raise SystemExit(f"no player PGNs found in {args.source}")
+    print(f"{len(players)} players, {args.workers} engines ({args.threads} threads each)")
+
+    hash_mb = args.hash or max(16, ENGINE_HASH // args.workers)
+    options = {
+        "depth": args.depth,
+        "compat": args.compat,
+        "player_only": args.player_only,
+        "multipv": 1,
+        "adaptive": False,
+        "adaptive_verify": 0,
+        "syzygy_path": args.syzygy,
+        "cache_path": None if args.no_cache else args.cache,
+        "cache_max_entries": CACHE_MAX_ENTRIES,
+    }
+    # same as Clean.py's, so a player's folder can be resumed by either
+    checkpoint_options = {"depth": args.depth, "compat": args.compat, "player_only": args.player_only,
+                          "multipv": 1, "adaptive": False, "syzygy": bool(args.syzygy), "incremental": False}
+
+    # players finished by an earlier run, whose PGNs haven't changed since
+    if not args.restart:
+        finished = [name for name, pgn_files in players.items()
+                    if player_is_done(player_dir(name, args.out_dir), done_state(pgn_files, checkpoint_options))]
+        if finished:
+            print(f"{len(finished)} players already done (skipping; pass --restart to redo them)")
+        for name in finished:
+            del players[name]
+
+    def make_job(name, pgn_files):
+        out_dir = player_dir(name, args.out_dir)
+        # a new export of a finished player starts over, like a fresh Clean.py run
+        if os.path.exists(os.path.join(out_dir, DONE_FILE)):
+            os.remove(os.path.join(out_dir, DONE_FILE))
+        return PlayerJob(name, pgn_files, out_dir, checkpoint_options, not args.restart)
+
+    fair = FairQueue(players, make_job, args.max_active)
+    pool = multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=(args.threads, hash_mb, options))
+
+    # finished games come back through this queue, in whatever order the engines finish them
+    done = queue.Queue()
+
+    def on_result(job, seq, pgn_path, result):
+        done.put((job, seq, pgn_path, result))
+
+    max_in_flight = args.workers * MAX_IN_FLIGHT_PER_WORKER
+    in_flight = 0
+    run_stats = Counter()
+    games_total = games_done = players_done = 0
+    start = last_status = time.monotonic()
+
+    def finish_jobs(jobs):
+        nonlocal players_done
+        for job in jobs:
+            if job.finished:
+                job.close()
+                fair.retire(job)
+                players_done += 1
+                print(f"Finished {job.name}: {job.games_done} games in "
+                      f"{format_duration(time.monotonic() - job.started)} ({players_done}/{len(players)} players)")
+
+    try:
+        while True:
+            new_jobs = fair.admit()
+            games_total += sum(job.games_total for job in new_jobs)
+            finish_jobs(new_jobs)  # players with nothing left to do
+
+            while in_flight < max_in_flight:
+                task = fair.next_task()
+                if task is None:
+                    break
+                job, seq, pgn_path, game_args, meta = task
+                pool.apply_async(_analyse_game_task, ((game_args, meta),),
+                                 callback=partial(on_result, job, seq, pgn_path),
+                                 error_callback=done.put)
+                in_flight += 1
+
+            if not in_flight:
+                if fair.waiting or fair.active:
+                    continue
+                break
+
+            item = done.get()
+            if isinstance(item, BaseException):
+                raise item
+            job, seq, pgn_path, (meta, rows, game_stats) = item
+            in_flight -= 1
+            run_stats.update(game_stats)
+            games_done += job.add_result(seq, pgn_path, meta, rows)
+            finish_jobs([job])
+
+            now = time.monotonic()
+            if now - last_status >= args.status_every:
+                last_status = now
+                rate = games_done / (now - start)
+                eta = (games_total - games_done) / rate if rate else None
+                print(f"\n[{format_duration(now - start)}] {players_done}/{len(players)} players done, "
+                      f"{games_done}/{games_total} games of admitted players, ETA {format_duration(eta)}"
+                      + (f", {len(fair.waiting)} players waiting" if fair.waiting else ""))
+                for active in fair.active:
+                    print(active.status())
+    except BaseException:
+        # keep the checkpoints so the next run resumes every player from here
+        for job in fair.active:
+            job.output.close()
+        pool.terminate()
+        raise
+
+    pool.close()
+    pool.join()
+    print_run_summary(run_stats)
+    print(f"\nAll done. Per-player CSVs written to {args.out_dir}/<player>/{OUTPUT_CSV}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import threading
+import time
+from collections import Counter
+
+from Clean import (DEPTH_SINGLE, MAX_IN_FLIGHT_PER_WORKER, OUTPUT_CSV, PGN_FILES,
+                   SYZYGY_PATH, CheckpointedOutput, _init_worker, analyse_pgn, build_analyser, print_run_summary)
+from EvalCache import CACHE_MAX_ENTRIES, CACHE_PATH
+from GameStore import GameStore
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+
+SHARD_GAMES = 200     # games per shard
+LEASE_TIMEOUT = 600   # seconds without a heartbeat before a shard's lease can be re-claimed
+POLL_EVERY = 10       # seconds between looks at the queue while other nodes hold the last shards
+SHARD_HASH = 128      # MB per engine, the same on every node (with Threads=1) so every node finds the same scores
+
+PLAN_FILE = "plan.json"
+LEASE_DIR = "leases"    # <shard>.<generation>.lease: who works on a shard; its mtime is the heartbeat
+PART_DIR = "parts"      # <shard>.<node>.csv: rows of a shard while it is being analysed
+RESULT_DIR = "results"  # <shard>.csv: a finished shard, moved here in one rename
+
+
+# --------------------------------------------------
+# PLAN
+# --------------------------------------------------
+
+def _plan_path(shared, pgn_path):
+    """PGN paths inside the shared directory are stored relative to it, so nodes may mount it anywhere."""
+    path = os.path.abspath(pgn_path)
+    inside = os.path.commonpath([path, os.path.abspath(shared)]) == os.path.abspath(shared)
+    return os.path.relpath(path, shared) if inside else path
+
+
+def make_plan(shared, pgn_files, shard_games, options, force=False):
+    """
+    Split every PGN into shards of shard_games consecutive games and write
+    the plan to the shared directory. The parsed-game stores are built here
+    too, once, rather than by every node at the same time. An existing plan
+    is only replaced with force, which also drops its leases and results.
+    """
+    if os.path.exists(os.path.join(shared, PLAN_FILE)):
+        if not force:
+            raise SystemExit(f"{shared} already has a {PLAN_FILE}; pass --force to start over")
+        for name in (LEASE_DIR, PART_DIR, RESULT_DIR):
+            shutil.rmtree(os.path.join(shared, name), ignore_errors=True)
+
+    shards = []
+    for pgn_path, color_label in pgn_files:
+        if not os.path.exists(pgn_path):
+            print(f"PGN file not found: {pgn_path} (skipping)")
+            continue
+        game_no = GameStore(pgn_path).game_no.tolist()
+        for i in range(0, len(game_no), shard_games):
+            first, last = game_no[i], game_no[min(i + shard_games, len(game_no)) - 1]
+            shards.append({
+                "id": f"{color_label}-{first:07d}",
+                "pgn": _plan_path(shared, pgn_path),
+                "color_label": color_label,
+                "first": first,
+                "last": last,
+            })
+        print(f"{pgn_path}: {len(game_no)} games")
+
+    for name in (LEASE_DIR, PART_DIR, RESULT_DIR):
+        os.makedirs(os.path.join(shared, name), exist_ok=True)
+    tmp_path = os.path.join(shared, PLAN_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"options": options, "shards": shards}, f, indent=1)
+    os.replace(tmp_path, os.path.join(shared, PLAN_FILE))
+    return shards
+
+
+def load_plan(shared):
+    path = os.path.join(shared, PLAN_FILE)
+    if not os.path.exists(path):
+        raise SystemExit(f"no {PLAN_FILE} in {shared}; run `python Shards.py plan {shared}` first")
+    with open(path, encoding="utf-8") as f:
+        plan = json.load(f)
+    for shard in plan["shards"]:
+        shard["pgn"] = os.path.join(shared, shard["pgn"])
+    return plan
+
+
+# --------------------------------------------------
+# LEASE QUEUE
+# --------------------------------------------------
+
+class ShardQueue:
+    """
+    Work queue kept as plain files in a directory every node can reach; no
+    broker is needed.
+
+    Every claim of a shard creates the next generation of its lease,
+    leases/<shard>.<generation>.lease, by os.link of a finished temp file,
+    which fails if that generation exists already. The newest generation
+    says who holds the shard. While a node works it keeps touching its
+    lease (the heartbeat). A newest lease that hasn't been touched for
+    lease_timeout seconds is taken to belong to a dead node, and another
+    node claims the shard by creating the generation after it. Nodes that
+    find the same lease stale race for the same next generation and only
+    one link can win, so a takeover can't be split by another node's
+    claim. Leases of an unfinished shard are never deleted (a release
+    backdates the lease instead), so generations only go up and a node
+    with an out-of-date view aims at a generation that already exists.
+
+    A finished shard is renamed into results/ in one step, so a shard is
+    either done or not. Two nodes that both finish the same shard (after
+    a lease was taken from a node that was only slow) write the same rows,
+    so the later rename does no harm.
+    """
+
+    def __init__(self, shared, shards, node, lease_timeout=LEASE_TIMEOUT):
+        self.shared = shared
+        self.shards = shards
+        self.node = node
+        self.lease_timeout = lease_timeout
+        self.held = {}  # shard id -> generation of the lease this node created
+
+    def lease_path(self, shard, generation):
+        return os.path.join(self.shared, LEASE_DIR, f"{shard['id']}.{generation}.lease")
+
+    def part_path(self, shard):
+        return os.path.join(self.shared, PART_DIR, f"{shard['id']}.{self.node}.csv")
+
+    def result_path(self, shard):
+        return os.path.join(self.shared, RESULT_DIR, shard["id"] + ".csv")
+
+    def is_done(self, shard):
+        return os.path.exists(self.result_path(shard))
+
+    def newest_leases(self):
+        """{shard id: newest lease generation}, from one listing of the lease directory."""
+        newest = {}
+        for name in os.listdir(os.path.join(self.shared, LEASE_DIR)):
+            shard_id, generation, suffix = name.rsplit(".", 2)
+            if suffix != "lease":
+                continue  # a temp file
+            generation = int(generation)
+            newest[shard_id] = max(newest.get(shard_id, generation), generation)
+        return newest
+
+    def lease_expired(self, shard, generation):
+        try:
+            return time.time() - os.path.getmtime(self.lease_path(shard, generation)) > self.lease_timeout
+        except FileNotFoundError:
+            return True
+
+    def _create_lease(self, shard, generation):
+        """Create this generation of the shard's lease, with its content; False if another node has it."""
+        path = self.lease_path(shard, generation)
+        tmp_path = f"{path}.{self.node}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"node": self.node, "claimed": time.time()}, f)
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+        self.held[shard["id"]] = generation
+        return True
+
+    def claim(self):
+        """The first unfinished shard nobody holds a live lease on (now leased to this node), or None."""
+        newest = self.newest_leases()
+        for shard in self.shards:
+            if self.is_done(shard):
+                continue
+            current = newest.get(shard["id"])
+            if current is not None and not self.lease_expired(shard, current):
+                continue
+            if not self._create_lease(shard, 0 if current is None else current + 1):
+                continue  # another node claimed it first
+            if self.is_done(shard):  # finished between the check and the claim
+                self.release(shard)
+                continue
+            if current is not None:
+                print(f"Re-claiming {shard['id']}: its lease expired")
+            return shard
+        return None
+
+    def renew(self, shard):
+        try:
+            os.utime(self.lease_path(shard, self.held[shard["id"]]))
+        except FileNotFoundError:
+            pass  # finished by another node; our rows are still correct
+
+    def holds(self, shard):
+        """Whether the shard's newest lease is still this node's (it may have expired and been re-claimed)."""
+        generation = self.held.get(shard["id"])
+        return generation is not None and self.newest_leases().get(shard["id"]) == generation
+
+    def release(self, shard):
+        """Let any node claim the shard at once, by backdating this node's lease."""
+        if self.holds(shard):
+            try:
+                os.utime(self.lease_path(shard, self.held[shard["id"]]), (0, 0))
+            except FileNotFoundError:
+                pass
+        self.held.pop(shard["id"], None)
+
+    def complete(self, shard):
+        """Publish the shard's rows and drop its leases, which nobody needs once it is done."""
+        os.replace(self.part_path(shard), self.result_path(shard))
+        self.held.pop(shard["id"], None)
+        for generation in range(self.newest_leases().get(shard["id"], -1) + 1):
+            try:
+                os.remove(self.lease_path(shard, generation))
+            except FileNotFoundError:
+                pass
+
+    def counts(self):
+        """(done, leased, waiting) shard counts."""
+        newest = self.newest_leases()
+        done = sum(self.is_done(shard) for shard in self.shards)
+        leased = sum(
+            not self.is_done(shard) and shard["id"] in newest and not self.lease_expired(shard, newest[shard["id"]])
+            for shard in self.shards
+        )
+        return done, leased, len(self.shards) - done - leased
+
+
+class Heartbeat:
+    """Touch a shard's lease every interval seconds in the background while the shard is analysed."""
+
+    def __init__(self, queue, shard, interval):
+        self.queue = queue
+        self.shard = shard
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.queue.renew(self.shard)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        return False
+
+
+# --------------------------------------------------
+# MERGE
+# --------------------------------------------------
+
+def merge_results(shared, shards, output_csv):
+    """
+    Concatenate the finished shards in plan order (PGN_FILES order, then
+    game number) into one CSV, byte for byte what a single-node run writes.
+    Partial files and leases left by dead nodes are removed afterwards.
+    """
+    missing = [shard["id"] for shard in shards
+               if not os.path.exists(os.path.join(shared, RESULT_DIR, shard["id"] + ".csv"))]
+    if missing:
+        raise SystemExit(f"{len(missing)} shards are not finished yet, e.g. {', '.join(missing[:5])}")
+
+    tmp_path = output_csv + ".tmp"
+    header = None
+    with open(tmp_path, "wb") as out:
+        for shard in shards:
+            with open(os.path.join(shared, RESULT_DIR, shard["id"] + ".csv"), "rb") as f:
+                shard_header = f.readline()
+                if header is None:
+                    header = shard_header
+                    out.write(header)
+                elif shard_header != header:
+                    raise SystemExit(f"shard {shard['id']} has a different header: {shard_header!r}")
+                while True:
+                    block = f.read(1 << 20)
+                    if not block:
+                        break
+                    out.write(block)
+    os.replace(tmp_path, output_csv)
+
+    # every shard is finished, so what is left in parts/ and leases/ was
+    # written by nodes that died or were late
+    for directory in (PART_DIR, LEASE_DIR):
+        for name in os.listdir(os.path.join(shared, directory)):
+            os.remove(os.path.join(shared, directory, name))
+
+
+# --------------------------------------------------
+# RUN
+# --------------------------------------------------
+
+def work(args):
+    plan = load_plan(args.shared)
+    shards = plan["shards"]
+    node = args.node or f"{socket.gethostname()}-{os.getpid()}"
+    queue = ShardQueue(args.shared, shards, node, args.lease_timeout)
+
+    # the numbers must not depend on the node, so the analysis options and
+    # the engine's hash size come from the plan, and every engine runs one
+    # thread (a multi-threaded search is not reproducible)
+    threads = 1
+    hash_mb = plan["options"].get("hash_mb", SHARD_HASH)
+    options = dict(plan["options"], multipv=1, adaptive=False, adaptive_verify=0,
+                   cache_path=None if args.no_cache else args.cache, cache_max_entries=CACHE_MAX_ENTRIES)
+    checkpoint_options = {"depth": options["depth"], "compat": options["compat"],
+                          "player_only": options["player_only"], "multipv": 1, "adaptive": False,
+                          "syzygy": bool(options["syzygy_path"]), "incremental": False}
+
+    analyser = pool = None
+    if args.workers == 1:
+        analyser = build_analyser(threads, hash_mb, options)
+    else:
+        pool = multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=(threads, hash_mb, options))
+    print(f"Node {node}: {args.workers} engines ({hash_mb} MB hash each), {len(shards)} shards in {args.shared}")
+
+    run_stats = Counter()
+    shards_done = 0
+    try:
+        while True:
+            shard = queue.claim()
+            if shard is None:
+                done, leased, _waiting = queue.counts()
+                if done == len(shards):
+                    break
+                # the last shards are held by other nodes; wait in case one of them dies
+                print(f"\n{done}/{len(shards)} shards done, {leased} held by other nodes; waiting")
+                time.sleep(args.poll_every)
+                continue
+
+            print(f"\n=== Shard {shard['id']}: games {shard['first']}-{shard['last']} of {shard['pgn']} ===")
+            part = queue.part_path(shard)
+            output = CheckpointedOutput(part, part + ".checkpoint.json", options=checkpoint_options, resume=False)
+            try:
+                with Heartbeat(queue, shard, max(args.lease_timeout / 3, 1)):
+                    analyse_pgn(shard["pgn"], shard["color_label"], output, analyser=analyser, pool=pool,
+                                max_in_flight=args.workers * MAX_IN_FLIGHT_PER_WORKER, run_stats=run_stats,
+                                options=options, games=(shard["first"], shard["last"]))
+            except BaseException:
+                output.close()
+                queue.release(shard)  # let another node have it straight away
+                raise
+            output.close(completed=True)
+            queue.complete(shard)
+            shards_done += 1
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        # the engine's I/O thread would keep the process alive otherwise
+        if analyser is not None:
+            analyser.close()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    print_run_summary(run_stats)
+    print(f"\nNode {node} finished {shards_done} shards; all {len(shards)} are done. "
+          f"Run `python Shards.py merge {args.shared}` to build {OUTPUT_CSV}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run Clean.py's analysis on several machines through a shared directory.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = commands.add_parser("plan", help="split the PGN files into shards")
+    plan_parser.add_argument("shared", help="directory every node can reach")
+    plan_parser.add_argument("--shard-games", type=int, default=SHARD_GAMES, metavar="N",
+                             help=f"games per shard (default: {SHARD_GAMES})")
+    plan_parser.add_argument("--depth", type=int, default=DEPTH_SINGLE,
+                             help=f"search depth (default: {DEPTH_SINGLE})")
+    plan_parser.add_argument("--compat", action="store_true", help="search twice per ply (see Clean.py)")
+    plan_parser.add_argument("--player-only", action="store_true", help="only analyse the player's own moves")
+    plan_parser.add_argument("--syzygy", default=SYZYGY_PATH, metavar="DIR",
+                             help="Syzygy tablebase directory, at the same path on every node")
+    plan_parser.add_argument("--hash", type=int, default=SHARD_HASH, metavar="MB",
+                             help=f"Hash MB of every engine on every node (default: {SHARD_HASH})")
+    plan_parser.add_argument("--force", action="store_true",
+                             help="replace an existing plan, dropping its leases and finished shards")
+
+    work_parser = commands.add_parser("work", help="claim and analyse shards until none are left")
+    work_parser.add_argument("shared", help="directory every node can reach")
+    work_parser.add_argument("--workers", type=int, default=1, help="Stockfish processes on this node (default: 1)")
+    work_parser.add_argument("--cache", default=CACHE_PATH,
+                             help=f"this node's eval cache; keep it off the shared directory (default: {CACHE_PATH})")
+    work_parser.add_argument("--no-cache", action="store_true",
+                             help="never read or write the eval cache (needed for rows identical to Clean.py's)")
+    work_parser.add_argument("--node", help="name of this node in lease and part files (default: host-pid)")
+    work_parser.add_argument("--lease-timeout", type=float, default=LEASE_TIMEOUT, metavar="SECONDS",
+                             help=f"re-claim shards whose lease is older than this (default: {LEASE_TIMEOUT})")
+    work_parser.add_argument("--poll-every", type=float, default=POLL_EVERY, metavar="SECONDS",
+                             help=f"wait between looks at the queue when other nodes hold the rest (default: {POLL_EVERY})")
+
+    status_parser = commands.add_parser("status", help="show how many shards are done, leased and waiting")
+    status_parser.add_argument("shared", help="directory every node can reach")
+    status_parser.add_argument("--lease-timeout", type=float, default=LEASE_TIMEOUT, metavar="SECONDS")
+
+    merge_parser = commands.add_parser("merge", help=f"combine the finished shards into {OUTPUT_CSV}")
+    merge_parser.add_argument("shared", help="directory every node can reach")
+    merge_parser.add_argument("--output", default=OUTPUT_CSV, help=f"CSV to write (default: {OUTPUT_CSV})")
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        options = {"depth": args.depth, "compat": args.compat, "player_only": args.player_only,
+                   "syzygy_path": args.syzygy, "hash_mb": args.hash}
+        shards = make_plan(args.shared, PGN_FILES, args.shard_games, options, force=args.force)
+        print(f"{len(shards)} shards of up to {args.shard_games} games written to {args.shared}/{PLAN_FILE}")
+    elif args.command == "work":
+        if args.workers < 1:
+            parser.error("--workers must be at least 1")
+        work(args)
+    elif args.command == "status":
+        shards = load_plan(args.shared)["shards"]
+        done, leased, waiting = ShardQueue(args.shared, shards, "status", args.lease_timeout).counts()
+        print(f"{len(shards)} shards: {done} done, {leased} leased, {waiting} waiting or expired")
+    else:
+        shards = load_plan(args.shared)["shards"]
+        merge_results(args.shared, shards, args.output)
+        print(f"Merged {len(shards)} shards into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
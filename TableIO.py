@@ -0,0 +1,160 @@
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional: pip install pyarrow
+    pa = None
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+
+PARQUET_SUFFIX = ".parquet"
+PARQUET_COMPRESSION = "zstd"
+PARQUET_BATCH_ROWS = 65_536   # rows per record batch when streaming
+
+# compact types for the columns of games_with_errors.csv and its derived files;
+# string columns are written dictionary-encoded
+COLUMN_TYPES = {
+    "game_id": "int32",
+    "move_number": "int16",
+    "ply": "int16",
+    "best_cp": "int32",
+    "played_cp": "int32",
+    "cp_drop": "int32",
+}
+
+
+# --------------------------------------------------
+# HELPERS
+# --------------------------------------------------
+
+def parquet_path_for(csv_path):
+    """games_with_errors.csv -> games_with_errors.parquet"""
+    return os.path.splitext(str(csv_path))[0] + PARQUET_SUFFIX
+
+
+def require_parquet():
+    if pa is None:
+        raise SystemExit("Parquet output needs pyarrow: pip install pyarrow")
+
+
+def parquet_source(csv_path):
+    """
+    The Parquet twin of csv_path if it can be read and is not older than
+    the CSV (a CSV rewritten without --parquet wins), else None.
+    """
+    path = parquet_path_for(csv_path)
+    if pa is None or not os.path.exists(path):
+        return None
+    if os.path.exists(csv_path) and os.path.getmtime(path) < os.path.getmtime(csv_path):
+        return None
+    return path
+
+
+def _plain_strings(df):
+    # dictionary-encoded columns come back as categoricals; give callers the
+    # same object columns read_csv would, so groupbys don't grow empty groups
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+    return df
+
+
+def read_table(csv_path, columns=None):
+    """
+    Load csv_path, preferring its Parquet twin (see parquet_source). Only
+    `columns` are loaded when given, which Parquet does without touching the
+    rest of the file.
+    """
+    path = parquet_source(csv_path)
+    if path is not None:
+        return _plain_strings(pd.read_parquet(path, columns=columns))
+    return pd.read_csv(csv_path, usecols=columns)
+
+
+def _compact_schema(schema):
+    """COLUMN_TYPES for the known columns, dictionary-encoded strings, anything else as inferred."""
+    fields = []
+    for field in schema:
+        if field.name in COLUMN_TYPES:
+            field = field.with_type(pa.from_numpy_dtype(COLUMN_TYPES[field.name]))
+        elif pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def write_parquet(df, csv_path):
+    """Write df next to csv_path as typed, compressed Parquet with dictionary-encoded strings."""
+    require_parquet()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.cast(_compact_schema(table.schema))
+    path = parquet_path_for(csv_path)
+    pq.write_table(table, path, compression=PARQUET_COMPRESSION)
+    return path
+
+
+def csv_to_parquet(csv_path):
+    """
+    Convert a finished CSV to its Parquet twin batch by batch, so memory
+    stays flat however large the CSV is.
+    """
+    require_parquet()
+    path = parquet_path_for(csv_path)
+    tmp_path = path + ".tmp"
+
+    reader = pyarrow.csv.open_csv(
+        csv_path,
+        convert_options=pyarrow.csv.ConvertOptions(
+            column_types={name: pa.from_numpy_dtype(t) for name, t in COLUMN_TYPES.items()},
+        ),
+    )
+    schema = _compact_schema(reader.schema)
+    with pq.ParquetWriter(tmp_path, schema, compression=PARQUET_COMPRESSION) as writer:
+        for batch in reader:
+            writer.write_table(pa.Table.from_batches([batch]).cast(schema))
+    os.replace(tmp_path, path)
+    return path
+
+
+class ParquetChunkReader:
+    """get_chunk(rows) over a Parquet file, like the reader pd.read_csv(iterator=True) returns."""
+
+    def __init__(self, path, columns=None):
+        self.batches = pq.ParquetFile(path).iter_batches(batch_size=PARQUET_BATCH_ROWS, columns=columns)
+        self.pending = None  # rows read from the file but not returned yet
+
+    def get_chunk(self, rows):
+        parts = [self.pending] if self.pending is not None else []
+        have = self.pending.num_rows if self.pending is not None else 0
+        while have < rows:
+            batch = next(self.batches, None)
+            if batch is None:
+                break
+            parts.append(pa.Table.from_batches([batch]))
+            have += batch.num_rows
+        if not have:
+            raise StopIteration
+
+        table = pa.concat_tables(parts)
+        self.pending = table.slice(rows) if table.num_rows > rows else None
+        return table.slice(0, rows).to_pandas()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def open_chunks(csv_path, dtype=None, columns=None):
+    """Chunk reader over csv_path, or over its Parquet twin when there is one. Only `columns` are read when given."""
+    path = parquet_source(csv_path)
+    if path is not None:
+        return ParquetChunkReader(path, columns=columns)
+    return pd.read_csv(csv_path, dtype=dtype, usecols=columns, iterator=True)
@@ -0,0 +1,105 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from Calculation import ERROR_TYPES, PHASES, player_error_counts
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+
+ROWS = 5_000_000
+SEED = 13
+
+# share of labels in a typical games_with_errors.csv
+ERROR_MIX = {"ok": 0.80, "inaccuracy": 0.09, "mistake": 0.06, "blunder": 0.05}
+
+
+# --------------------------------------------------
+# HELPERS
+# --------------------------------------------------
+
+def synthetic_games(rows: int, seed: int = SEED) -> pd.DataFrame:
+    """A games_with_errors.csv-shaped frame with the columns Calculation.py reads."""
+    rng = np.random.default_rng(seed)
+    ply = rng.integers(1, 161, rows)
+    return pd.DataFrame({
+        "color_file": rng.choice(["white_file", "black_file"], rows),
+        "move_number": (ply + 1) // 2,
+        "side": np.where(ply % 2 == 1, "White", "Black"),
+        "error_type": rng.choice(list(ERROR_MIX), rows, p=list(ERROR_MIX.values())),
+    })
+
+
+def legacy_counts(df: pd.DataFrame):
+    """The previous Calculation.py: per-row apply plus separate passes per color."""
+    def assign_phase(move_number: int) -> str:
+        if move_number <= 15:
+            return "opening"
+        elif move_number <= 40:
+            return "middlegame"
+        else:
+            return "endgame"
+
+    result = {}
+    for color_file, side in [("white_file", "White"), ("black_file", "Black")]:
+        colored_df = df[(df["color_file"] == color_file) & (df["side"] == side)].copy()
+        colored_df[colored_df["error_type"].isin(ERROR_TYPES)]["error_type"].value_counts()
+        colored_df["phase"] = colored_df["move_number"].apply(assign_phase)
+        result[color_file] = (
+            colored_df[colored_df["error_type"].isin(ERROR_TYPES)]
+            .groupby(["phase", "error_type"])
+            .size()
+            .unstack(fill_value=0)
+            .reindex(index=PHASES, columns=ERROR_TYPES, fill_value=0)
+        )
+    return result
+
+
+def vectorized_counts(df: pd.DataFrame):
+    counts = player_error_counts(df)
+    result = {}
+    for color_file in ["white_file", "black_file"]:
+        table = counts.loc[color_file].unstack()
+        result[color_file] = table.reindex(index=PHASES, columns=ERROR_TYPES)
+    return result
+
+
+def best_time(fn, df, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn(df)
+        times.append(time.perf_counter() - start)
+    return min(times), out
+
+
+# --------------------------------------------------
+# RUN
+# --------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Time Calculation.py's error counting against the old per-row version.")
+    parser.add_argument("--rows", type=int, default=ROWS, help=f"synthetic rows (default: {ROWS})")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per version, best one is reported")
+    args = parser.parse_args()
+
+    df = synthetic_games(args.rows)
+    print(f"{args.rows} synthetic rows, best of {args.repeat} runs\n")
+
+    legacy_time, legacy = best_time(legacy_counts, df, args.repeat)
+    new_time, new = best_time(vectorized_counts, df, args.repeat)
+
+    for color_file in legacy:
+        if not (legacy[color_file].values == new[color_file].values).all():
+            raise SystemExit(f"counts differ for {color_file}")
+
+    print(f"Per-row apply, two passes:     {legacy_time:7.2f} s")
+    print(f"Vectorized, one groupby:       {new_time:7.2f} s")
+    print(f"Speed-up:                      {legacy_time / new_time:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()